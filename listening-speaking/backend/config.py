@@ -49,7 +49,8 @@ class ServiceConfig:
         "vision": {
             "analyze_manga": f"{MANGAOCR_URL}/analyze",  # MangaOCR for Japanese text recognition
             "analyze_image": f"{VISION_URL}/analyze",  # LLaVA for general image analysis
-            "generate": f"{WAIFU_DIFFUSION_URL}/generate"  # Waifu-diffusion for image generation
+            "generate": f"{WAIFU_DIFFUSION_URL}/generate",  # Waifu-diffusion for image generation
+            "generate_batch": f"{WAIFU_DIFFUSION_URL}/generate/batch"  # Several prompts in one diffusion pass
         },
         "embedding": {
             "embed": f"{EMBEDDING_URL}/embed"
@@ -10,6 +10,9 @@ from backend.image.llm_client import LLMClient
 
 logger = logging.getLogger(__name__)
 
+class ImageServiceBusy(Exception):
+    """Waifu-diffusion timed out or is at capacity; it may still be working on the request."""
+
 class ImageGenerator:
     def __init__(self):
         """Initialize image generator with retry configuration"""
@@ -119,6 +122,15 @@ class ImageGenerator:
             logger.error(f"Error analyzing image content: {str(e)}")
             return None
 
+    def _translate_prompt(self, prompt: str) -> str:
+        """Translate the prompt to English if it's in Japanese"""
+        if any(ord(c) > 0x4e00 for c in prompt):
+            logger.info("Translating Japanese prompt to English")
+            translated_prompt = self.llm_client.generate_response(f"Translate this Japanese text to English: {prompt}")
+            logger.info(f"Translated prompt: {translated_prompt}")
+            return translated_prompt
+        return prompt
+
     def generate_image(self, prompt: str, style: str = "anime") -> Optional[bytes]:
         """
         Generate image from prompt using Waifu-diffusion service.
@@ -131,13 +143,7 @@ class ImageGenerator:
             Optional[bytes]: Generated image data if successful, None otherwise
         """
         try:
-            # First translate the prompt to English if it's in Japanese
-            if any(ord(c) > 0x4e00 for c in prompt):
-                logger.info("Translating Japanese prompt to English")
-                translated_prompt = self.llm_client.generate_response(f"Translate this Japanese text to English: {prompt}")
-                logger.info(f"Translated prompt: {translated_prompt}")
-            else:
-                translated_prompt = prompt
+            translated_prompt = self._translate_prompt(prompt)
 
             # Use waifu-diffusion for image generation
             endpoint = ServiceConfig.get_endpoint("vision", "generate")
@@ -182,6 +188,55 @@ class ImageGenerator:
                     logger.error("Could not read response content")
             return None
 
+    def generate_images(self, prompts: List[str], seeds: Optional[List[int]] = None) -> Optional[List[bytes]]:
+        """
+        Generate one image per prompt in a single batched Waifu-diffusion call.
+        
+        Args:
+            prompts (List[str]): Text prompts for image generation
+            seeds (Optional[List[int]]): Per-image seeds for reproducible output
+            
+        Returns:
+            Optional[List[bytes]]: Image data in prompt order if successful, None otherwise
+
+        Raises:
+            ImageServiceBusy: If the request timed out or the service answered 503/504
+        """
+        try:
+            endpoint = ServiceConfig.get_endpoint("vision", "generate_batch")
+            if not endpoint:
+                logger.error("Waifu-diffusion batch endpoint not configured")
+                return None
+
+            payload = {"prompts": [self._translate_prompt(prompt) for prompt in prompts]}
+            if seeds is not None:
+                payload["seeds"] = seeds
+
+            logger.info(f"Sending batch image generation request to {endpoint} with {len(prompts)} prompts")
+            response = self.session.post(
+                endpoint,
+                json=payload,
+                timeout=ServiceConfig.get_timeout("waifu-diffusion")
+            )
+            if response.status_code in (503, 504):
+                raise ImageServiceBusy(f"Waifu-diffusion answered {response.status_code}: {response.text}")
+            response.raise_for_status()
+
+            import base64
+            images = response.json().get("images", [])
+            if len(images) != len(prompts):
+                logger.error(f"Expected {len(prompts)} images, got {len(images)}")
+                return None
+            logger.info(f"Successfully generated {len(images)} images (seeds: {[image.get('seed') for image in images]})")
+            return [base64.b64decode(image["image"]) for image in images]
+
+        except requests.exceptions.Timeout:
+            # The server may still be rendering the batch, so this is not a plain failure
+            raise ImageServiceBusy("Batch image generation timed out - this is normal when running on CPU")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error generating images: {str(e)}")
+            return None
+
     def save_image(self, image_data: bytes, filepath: str) -> bool:
         """
         Save image data to file.
@@ -252,10 +307,22 @@ class ImageGenerator:
         # Ensure images directory exists
         os.makedirs(images_dir, exist_ok=True)
         
+        # Render all options in one batched pass; fall back to one request per option
+        # if the batch fails (e.g. an older waifu-diffusion without /generate/batch).
+        # A busy or timed-out service gets no fallback: the batch may still be running,
+        # and more requests would only queue behind it.
+        option_letters = list(prompts.keys())
+        try:
+            batch = self.generate_images([prompts[letter] for letter in option_letters]) if option_letters else None
+        except ImageServiceBusy as e:
+            logger.error(f"Skipping option images: {str(e)}")
+            return image_paths
+        batch_images = dict(zip(option_letters, batch)) if batch else {}
+        
         for option_letter, prompt in prompts.items():
             try:
                 # Generate image
-                image_data = self.generate_image(prompt, style="anime")
+                image_data = batch_images.get(option_letter) or self.generate_image(prompt, style="anime")
                 if image_data:
                     # Create filename for this option
                     filename = f"{base_filename}_option_{option_letter}.png"
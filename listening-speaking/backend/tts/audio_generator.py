@@ -2,13 +2,16 @@
 
 import os
 import subprocess
-from typing import List, Optional
+from typing import Dict, List, Optional
 import tempfile
 import re
 import requests
 from backend.config import ServiceConfig
 import base64
 
+# "男の人：..." style speaker labels inside a generated conversation
+SPEAKER_PATTERN = re.compile(r'([^\s：:、。]{1,8})[：:]')
+
 class AudioGenerator:
     def __init__(self, tts_engine: str = "coqui", language: str = "ja"):
         """
@@ -64,22 +67,25 @@ class AudioGenerator:
             if speaker_wav and os.path.exists(speaker_wav):
                 payload["voice_id"] = speaker_wav
 
-            # Call TTS service
+            # Call TTS service, asking for raw WAV bytes instead of base64 JSON
             response = requests.post(
                 self.tts_api_url,
                 json=payload,
-                headers={"Content-Type": "application/json"}
+                headers={"Content-Type": "application/json", "Accept": "audio/wav"}
             )
 
             if response.status_code != 200:
                 raise Exception(f"TTS service returned status code {response.status_code}")
 
-            # Parse the JSON response and decode base64 audio data
-            response_data = response.json()
-            if "audio" not in response_data:
-                raise Exception("TTS service response missing audio data")
-            
-            audio_data = base64.b64decode(response_data["audio"])
+            if response.headers.get("Content-Type", "").startswith("audio/"):
+                audio_data = response.content
+            else:
+                # Older TTS services only return JSON with base64 audio data
+                response_data = response.json()
+                if "audio" not in response_data:
+                    raise Exception("TTS service response missing audio data")
+
+                audio_data = base64.b64decode(response_data["audio"])
 
             # Save the audio file
             with open(output_file, 'wb') as f:
@@ -98,6 +104,100 @@ class AudioGenerator:
                 os.remove(output_file)
             return None
 
+    def generate_dialogue_audio(self, lines: List[Dict], output_file: str) -> Optional[str]:
+        """
+        Generate a whole conversation in a single TTS batch call.
+        Args:
+        lines (List[Dict]): Lines with "text", optional "voice" ("male"/"female") and "pause_ms".
+        output_file (str): Path to save the combined audio (.wav, .ogg or .mp3).
+        Returns:
+        Optional[str]: Path to the generated audio file, or None if failed.
+        """
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+
+            batch_lines = []
+            for line in lines:
+                sanitized_text = self.sanitize_text(line["text"])
+                if not sanitized_text:
+                    continue
+                batch_lines.append({
+                    "text": sanitized_text,
+                    "voice_id": line.get("voice", "female"),
+                    "pause_ms": line.get("pause_ms", 500)
+                })
+            if not batch_lines:
+                raise ValueError("No text left after sanitization")
+
+            extension = os.path.splitext(output_file)[1].lstrip(".").lower()
+            audio_format = extension if extension in ("ogg", "mp3") else "wav"
+
+            response = requests.post(
+                f"{self.tts_api_url}/batch",
+                json={
+                    "lines": batch_lines,
+                    "language": self.language,
+                    "combine": True,
+                    "format": audio_format
+                },
+                headers={"Content-Type": "application/json", "Accept": "audio/*"}
+            )
+
+            if response.status_code != 200:
+                raise Exception(f"TTS service returned status code {response.status_code}")
+
+            with open(output_file, 'wb') as f:
+                f.write(response.content)
+
+            return output_file
+
+        except Exception as e:
+            print(f"Error generating dialogue audio: {str(e)}")
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            return None
+
+    def exercise_lines(self, question: Dict) -> List[Dict]:
+        """
+        Turn a stored listening question into lines for generate_dialogue_audio.
+        Args:
+        question (Dict): Question with Introduction, Conversation and Question fields (either case).
+        Returns:
+        List[Dict]: Lines with "text", "voice" and "pause_ms", in reading order.
+        """
+        def field(name: str) -> str:
+            return (question.get(name) or question.get(name.lower()) or "").strip()
+
+        lines = []
+        introduction = field("Introduction")
+        if introduction:
+            lines.append({"text": introduction, "voice": "female", "pause_ms": 1000})
+
+        conversation = field("Conversation")
+        parts = SPEAKER_PATTERN.split(conversation)
+        # parts alternates [text before the first label, speaker, text, speaker, text, ...]
+        turns = [(None, parts[0].strip())] + [(speaker, text.strip()) for speaker, text in zip(parts[1::2], parts[2::2])]
+        voices = {}
+        for speaker, text in turns:
+            if not text:
+                continue
+            if speaker not in voices:
+                if speaker and "女" in speaker:
+                    voices[speaker] = "female"
+                elif speaker and "男" in speaker:
+                    voices[speaker] = "male"
+                else:
+                    # Alternate unlabelled speakers so neighbouring turns sound different
+                    voices[speaker] = "male" if len(voices) % 2 == 0 else "female"
+            lines.append({"text": text, "voice": voices[speaker], "pause_ms": 500})
+
+        question_text = field("Question")
+        if question_text:
+            if lines:
+                lines[-1]["pause_ms"] = 1000
+            lines.append({"text": question_text, "voice": "female", "pause_ms": 0})
+        return lines
+
     def generate_audio_with_male_voice(self, text: str, output_file: str) -> Optional[str]:
         """
         Generate audio using the male voice reference.
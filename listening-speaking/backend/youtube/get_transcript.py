@@ -144,14 +144,24 @@ class YouTubeTranscriptDownloader:
 
                     if result and "text" in result:
                         # Convert ASR result to YouTube transcript format
-                        # ASR returns a single text block, so we'll create one segment
-                        transcript = [
-                            {
-                                "text": result["text"],
-                                "start": 0,
-                                "duration": 0
-                            }
-                        ]
+                        if result.get("segments"):
+                            transcript = [
+                                {
+                                    "text": segment["text"],
+                                    "start": segment["start"],
+                                    "duration": segment["duration"]
+                                }
+                                for segment in result["segments"]
+                            ]
+                        else:
+                            # Older ASR services return a single text block, so we'll create one segment
+                            transcript = [
+                                {
+                                    "text": result["text"],
+                                    "start": 0,
+                                    "duration": 0
+                                }
+                            ]
                         logger.info(f"Successfully generated Japanese transcript using ASR for video {video_id}")
                         return transcript
                     else:
@@ -539,6 +539,32 @@ def render_interactive_practice():
                     else:
                         print("Audio generation failed.")
 
+        # Full exercise (introduction, conversation and question) as one TTS batch call
+        dialogue_audio = current_qdata.get('dialogue_audio_file')
+        if dialogue_audio:
+            st.audio(dialogue_audio)
+        elif current_question:
+            if st.button("Generate Dialogue Audio"):
+                with st.spinner("Generating dialogue audio..."):
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    current_dir = os.path.dirname(os.path.abspath(__file__))
+                    project_root = os.path.dirname(current_dir)
+                    output_file = os.path.join(project_root, "backend", "data", "audio", f"dialogue_{timestamp}.mp3")
+                    audio_generator = st.session_state.audio_generator
+                    audio_file = audio_generator.generate_dialogue_audio(
+                        audio_generator.exercise_lines(current_question),
+                        output_file
+                    )
+                    if audio_file:
+                        current_qdata['dialogue_audio_file'] = audio_file
+                        stored_questions[current_qid] = current_qdata
+                        questions_file = os.path.join(project_root, "backend", "data", "stored_questions.json")
+                        with open(questions_file, 'w', encoding='utf-8') as f:
+                            json.dump(stored_questions, f, ensure_ascii=False, indent=2)
+                        st.rerun()
+                    else:
+                        print("Dialogue audio generation failed.")
+
 def render_sidebar():
     """Render sidebar with saved questions"""
     with st.sidebar:
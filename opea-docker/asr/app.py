@@ -1,14 +1,29 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import os
 import base64
+import json
 import tempfile
+import io
+import math
 import whisper
 import logging
-import librosa
 import soundfile as sf
 import numpy as np
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from scipy.signal import resample_poly
+
+from inference_executor import InferenceExecutor
+from chunking import plan_chunks, merge_segments, segments_to_text
+from vad import trim_silence, VadStats
+from backends import ASR_BACKEND, BACKENDS, BEAM_SIZE, COMPUTE_TYPE, create_backend
+from streaming import StreamingTranscriber
+from result_cache import ResultCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -16,208 +31,402 @@ logger = logging.getLogger(__name__)
 
 # Constants
 ASR_MODEL = os.getenv("ASR_MODEL", "base")  # Changed from large-v3 to base for faster processing
+SAMPLE_RATE = 16000  # Whisper's expected input rate
+LONG_AUDIO_SECONDS = 300  # Audio longer than this is transcribed in parallel chunks
+CHUNK_SECONDS = float(os.getenv("ASR_CHUNK_SECONDS", 120))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("ASR_CHUNK_OVERLAP_SECONDS", 2.0))
+CHUNK_WORKERS = int(os.getenv("ASR_CHUNK_WORKERS", 2))
+# Voice activity detection defaults; each can be overridden per request
+VAD_ENABLED = os.getenv("ASR_VAD", "true").lower() in ("1", "true", "yes")
+VAD_AGGRESSIVENESS = int(os.getenv("ASR_VAD_AGGRESSIVENESS", 2))
+VAD_MIN_SILENCE_MS = int(os.getenv("ASR_VAD_MIN_SILENCE_MS", 500))
+VAD_PADDING_MS = int(os.getenv("ASR_VAD_PADDING_MS", 200))
+# Transcription results are cached by decoded-audio hash and options
+ASR_CACHE_PATH = os.getenv("ASR_CACHE_PATH", "/app/data/whisper/asr_cache.sqlite")
+ASR_CACHE_MAX_BYTES = int(os.getenv("ASR_CACHE_MAX_MB", 256)) * 1024 * 1024
+ASR_CACHE_ENABLED = os.getenv("ASR_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+# Streaming: re-decode every STEP seconds over a window trimmed past WINDOW seconds
+STREAM_STEP_SECONDS = float(os.getenv("ASR_STREAM_STEP_SECONDS", 1.0))
+STREAM_WINDOW_SECONDS = float(os.getenv("ASR_STREAM_WINDOW_SECONDS", 15.0))
+STREAM_MAX_SECONDS = float(os.getenv("ASR_STREAM_MAX_SECONDS", 600))
+
+# soxr is the fastest resampler; fall back to scipy's polyphase filter without it
+try:
+    import soxr
+    soxr_available = True
+except ImportError:
+    logger.info("soxr not available, using scipy polyphase resampling")
+    soxr_available = False
+
+class Segment(BaseModel):
+    text: str
+    start: float
+    duration: float
 
 class ASRResponse(BaseModel):
     text: str
     confidence: float
     language: str
+    segments: List[Segment] = []
+    audio_seconds: Optional[float] = None
+    speech_seconds: Optional[float] = None
+    cached: bool = False
 
 # Initialize FastAPI app
 app = FastAPI()
 
-# Initialize Whisper model
+vad_stats = VadStats()
+
+_result_cache = None
+
+def get_result_cache() -> Optional[ResultCache]:
+    global _result_cache
+    if _result_cache is None and ASR_CACHE_ENABLED:
+        try:
+            _result_cache = ResultCache(ASR_CACHE_PATH, ASR_CACHE_MAX_BYTES)
+        except Exception as e:
+            logger.warning(f"ASR result cache unavailable: {e}")
+    return _result_cache
+
+# Whisper inference runs here so the event loop (and /health) stays responsive
+asr_executor = InferenceExecutor("asr", max_workers=1, max_queue=16, timeout=900)
+
+# Initialize the ASR backend selected by ASR_BACKEND
 _asr_model = None
+backend_thread_safe = getattr(BACKENDS.get(ASR_BACKEND), "thread_safe", False)
+
+def load_backend():
+    # A thread-safe backend is shared by all chunk workers, so let it decode that many in parallel
+    options = {"num_workers": CHUNK_WORKERS} if backend_thread_safe else {}
+    return create_backend(ASR_MODEL, **options)
 
 def get_asr_model():
     global _asr_model
     if _asr_model is None:
         try:
-            logger.info(f"Initializing Whisper model: {ASR_MODEL}")
-            _asr_model = whisper.load_model(ASR_MODEL)
-            logger.info("Whisper model initialized successfully")
+            logger.info(f"Initializing {ASR_BACKEND} model: {ASR_MODEL}")
+            _asr_model = load_backend()
+            logger.info("ASR model initialized successfully")
         except Exception as e:
-            logger.error(f"Error initializing Whisper model: {e}")
+            logger.error(f"Error initializing ASR model: {e}")
     return _asr_model
 
-def preprocess_audio(audio_file_path: str) -> str:
+# openai-whisper installs decoder hooks on the model for every decode, so parallel
+# chunk workers each need their own instance; they are loaded on first use.
+# Thread-safe backends just share the primary instance.
+_chunk_models = queue.Queue()
+_chunk_models_loaded = 0
+_chunk_models_lock = threading.Lock()
+chunk_pool = ThreadPoolExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix="asr-chunk")
+
+@contextmanager
+def borrow_chunk_model():
+    global _chunk_models_loaded
+    if backend_thread_safe:
+        yield get_asr_model()
+        return
+    with _chunk_models_lock:
+        if _chunk_models.empty() and _chunk_models_loaded < CHUNK_WORKERS:
+            model = get_asr_model() if _chunk_models_loaded == 0 else load_backend()
+            _chunk_models_loaded += 1
+            _chunk_models.put(model)
+    model = _chunk_models.get()
+    try:
+        yield model
+    finally:
+        _chunk_models.put(model)
+
+def to_response_segments(segments: List[dict]) -> List[dict]:
+    return [
+        {"text": seg["text"].strip(), "start": float(seg["start"]), "duration": float(seg["end"]) - float(seg["start"])}
+        for seg in segments
+        if seg["text"].strip()
+    ]
+
+def resample(audio: np.ndarray, orig_sr: int, target_sr: int = SAMPLE_RATE) -> np.ndarray:
+    """Resample with soxr when available, otherwise with a polyphase filter."""
+    if orig_sr == target_sr:
+        return audio
+    if soxr_available:
+        return soxr.resample(audio, orig_sr, target_sr)
+    factor = math.gcd(orig_sr, target_sr)
+    return resample_poly(audio, target_sr // factor, orig_sr // factor)
+
+def preprocess_audio(audio: np.ndarray) -> np.ndarray:
+    """Peak-normalize decoded audio and make sure it is float32 for Whisper."""
+    peak = np.max(np.abs(audio)) if audio.size else 0.0
+    if peak > 0:
+        audio = audio / peak
+    return audio.astype(np.float32)
+
+def decode_audio(data: bytes, suffix: str = ".wav") -> np.ndarray:
     """
-    Preprocess audio to reduce file size and improve processing speed.
-    - Resample to 16kHz (Whisper's preferred sample rate)
-    - Convert to mono if stereo
-    - Normalize audio levels
-    - For very large files, chunk them into smaller segments
+    Decode uploaded audio bytes straight into a 16 kHz mono float32 array.
+    libsndfile handles WAV/FLAC/OGG (and MP3 on recent builds) from memory;
+    only formats it can't read are written to a temp file and decoded with ffmpeg.
     """
     try:
-        logger.info(f"Preprocessing audio file: {audio_file_path}")
-        
-        # Load audio with librosa
-        audio, sr = librosa.load(audio_file_path, sr=None, mono=False)
-        
-        # Convert to mono if stereo
-        if len(audio.shape) > 1:
-            audio = np.mean(audio, axis=0)
-            logger.info("Converted stereo to mono")
-        
-        # Resample to 16kHz if needed
-        if sr != 16000:
-            audio = librosa.resample(audio, orig_sr=sr, target_sr=16000)
-            logger.info(f"Resampled from {sr}Hz to 16000Hz")
-        
-        # Normalize audio
-        audio = librosa.util.normalize(audio)
-        
-        # Check if file is very large (> 10MB) and chunk if necessary
-        duration = len(audio) / 16000  # Duration in seconds
-        if duration > 300:  # If longer than 5 minutes, chunk it
-            logger.info(f"Audio is {duration:.1f} seconds long, chunking into segments")
-            chunk_duration = 300  # 5 minutes per chunk
-            chunk_samples = int(chunk_duration * 16000)
-            
-            # Create chunks directory
-            chunks_dir = os.path.join(os.path.dirname(audio_file_path), "chunks")
-            os.makedirs(chunks_dir, exist_ok=True)
-            
-            # Split audio into chunks
-            chunks = []
-            for i in range(0, len(audio), chunk_samples):
-                chunk = audio[i:i + chunk_samples]
-                chunk_path = os.path.join(chunks_dir, f"chunk_{i//chunk_samples}.wav")
-                sf.write(chunk_path, chunk, 16000)
-                chunks.append(chunk_path)
-                logger.info(f"Created chunk {i//chunk_samples}: {len(chunk)/16000:.1f}s")
-            
-            # Return the first chunk for now (we'll handle multiple chunks in speech_to_text)
-            return chunks[0] if chunks else audio_file_path
-        
-        # Save preprocessed audio
-        preprocessed_path = audio_file_path.replace('.wav', '_preprocessed.wav')
-        sf.write(preprocessed_path, audio, 16000)
-        
-        logger.info(f"Audio preprocessing completed. Original size: {os.path.getsize(audio_file_path)}, Preprocessed size: {os.path.getsize(preprocessed_path)}")
-        return preprocessed_path
-        
+        audio, sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        # Convert to mono and resample to 16kHz (Whisper's expected sample rate)
+        audio = resample(audio.mean(axis=1), sr)
     except Exception as e:
-        logger.error(f"Error preprocessing audio: {e}")
-        return audio_file_path  # Return original file if preprocessing fails
+        logger.info(f"In-memory decode failed ({e}), falling back to ffmpeg")
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file.write(data)
+            temp_filename = temp_file.name
+        try:
+            audio = whisper.load_audio(temp_filename, sr=SAMPLE_RATE)
+        finally:
+            os.unlink(temp_filename)
+    return preprocess_audio(audio)
 
-def speech_to_text(audio_file_path):
+def map_segments(segments: List[dict], time_map) -> List[dict]:
+    """Shift segment times from speech-only audio back onto the original recording."""
+    return [
+        {**seg, "start": time_map.to_original(seg["start"]), "end": time_map.to_original(seg["end"], end=True)}
+        for seg in segments
+    ]
+
+def speech_to_text(audio: np.ndarray, vad: Optional[bool] = None, vad_aggressiveness: Optional[int] = None,
+                   vad_min_silence_ms: Optional[int] = None):
     try:
         model = get_asr_model()
         if model is None:
             raise Exception("ASR model failed to initialize")
-        
-        # Check if this is a chunked file
-        chunks_dir = os.path.join(os.path.dirname(audio_file_path), "chunks")
-        if os.path.exists(chunks_dir):
-            logger.info("Processing chunked audio file")
-            chunk_files = sorted([f for f in os.listdir(chunks_dir) if f.endswith('.wav')])
-            
-            all_text = []
-            for i, chunk_file in enumerate(chunk_files):
-                chunk_path = os.path.join(chunks_dir, chunk_file)
-                logger.info(f"Processing chunk {i+1}/{len(chunk_files)}: {chunk_file}")
-                
-                # Process each chunk
-                result = model.transcribe(
-                    chunk_path,
-                    language="ja",
-                    task="transcribe"
-                )
-                
-                all_text.append(result["text"].strip())
-                
-                # Clean up chunk file
-                os.unlink(chunk_path)
-            
-            # Clean up chunks directory
-            os.rmdir(chunks_dir)
-            
+
+        audio_seconds = len(audio) / SAMPLE_RATE
+        time_map = None
+        if vad is None:
+            vad = VAD_ENABLED
+        if vad:
+            # Drop silence and non-speech so Whisper only decodes what was said
+            audio, time_map = trim_silence(
+                audio,
+                SAMPLE_RATE,
+                aggressiveness=VAD_AGGRESSIVENESS if vad_aggressiveness is None else vad_aggressiveness,
+                min_silence_ms=VAD_MIN_SILENCE_MS if vad_min_silence_ms is None else vad_min_silence_ms,
+                padding_ms=VAD_PADDING_MS
+            )
+            vad_stats.record(audio_seconds, len(audio) / SAMPLE_RATE)
+            logger.info(f"VAD kept {len(audio) / SAMPLE_RATE:.1f}s of {audio_seconds:.1f}s")
+        info = {"audio_seconds": round(audio_seconds, 3), "speech_seconds": round(len(audio) / SAMPLE_RATE, 3)}
+
+        if len(audio) == 0:
+            return {"text": "", "confidence": 0.0, "language": "ja", "segments": [], **info}
+
+        duration = len(audio) / SAMPLE_RATE
+        if duration > LONG_AUDIO_SECONDS:  # If longer than 5 minutes, transcribe chunks in parallel
+            chunks = plan_chunks(audio, SAMPLE_RATE, CHUNK_SECONDS, CHUNK_OVERLAP_SECONDS)
+            logger.info(f"Audio is {duration:.1f} seconds long, transcribing {len(chunks)} chunks on {CHUNK_WORKERS} workers")
+
+            def transcribe_chunk(chunk):
+                with borrow_chunk_model() as chunk_model:
+                    result = chunk_model.transcribe(audio[chunk["start"]:chunk["end"]], language="ja")
+                return result["segments"]
+
+            results = list(chunk_pool.map(transcribe_chunk, chunks))
+            segments = merge_segments(chunks, results, SAMPLE_RATE)
+            if time_map is not None:
+                segments = map_segments(segments, time_map)
+
             # Combine all text
-            full_text = " ".join(all_text)
-            logger.info(f"Combined transcription from {len(chunk_files)} chunks. Total text length: {len(full_text)}")
-            
-            return full_text, 0.95, "ja"
-        
-        # Preprocess the audio (for non-chunked files)
-        preprocessed_path = preprocess_audio(audio_file_path)
-        
-        logger.info(f"Starting transcription with model: {ASR_MODEL}")
-        
-        # Process with Whisper
+            full_text = segments_to_text(segments)
+            logger.info(f"Combined transcription from {len(chunks)} chunks. Total text length: {len(full_text)}")
+
+            return {"text": full_text, "confidence": 0.95, "language": "ja",
+                    "segments": to_response_segments(segments), **info}
+
+        logger.info(f"Starting transcription with {ASR_BACKEND} model: {ASR_MODEL}")
+
+        # Process with the backend, passing the decoded samples directly
         result = model.transcribe(
-            preprocessed_path,
-            language="ja",  # Specify Japanese for better accuracy
-            task="transcribe"
+            audio,
+            language="ja"  # Specify Japanese for better accuracy
         )
-        
+
         # Extract results
         text = result["text"]
         language = result.get("language", "ja")
         confidence = result.get("confidence", 0.95)
-        
+
+        segments = result["segments"]
+        if time_map is not None:
+            segments = map_segments(segments, time_map)
+
         logger.info(f"Transcription completed. Text length: {len(text)}")
-        
-        # Clean up preprocessed file if it was created
-        if preprocessed_path != audio_file_path and os.path.exists(preprocessed_path):
-            os.unlink(preprocessed_path)
-        
-        return text, confidence, language
+
+        return {"text": text, "confidence": confidence, "language": language,
+                "segments": to_response_segments(segments), **info}
     except Exception as e:
         logger.error(f"ASR processing failed: {str(e)}")
         raise Exception(f"ASR processing failed: {str(e)}")
 
+def transcribe_bytes(data: bytes, suffix: str = ".wav", vad: Optional[bool] = None,
+                     vad_aggressiveness: Optional[int] = None, vad_min_silence_ms: Optional[int] = None):
+    """Decode and transcribe an upload; blocking, so it runs on the ASR executor."""
+    audio = decode_audio(data, suffix)
+    options = {
+        "vad": VAD_ENABLED if vad is None else vad,
+        "vad_aggressiveness": VAD_AGGRESSIVENESS if vad_aggressiveness is None else vad_aggressiveness,
+        "vad_min_silence_ms": VAD_MIN_SILENCE_MS if vad_min_silence_ms is None else vad_min_silence_ms,
+    }
+
+    cache = get_result_cache()
+    if cache is None:
+        return speech_to_text(audio, **options)
+
+    # Everything that can change the transcript is part of the key
+    key = cache.make_key(
+        audio,
+        backend=ASR_BACKEND,
+        model=ASR_MODEL,
+        compute_type=COMPUTE_TYPE if ASR_BACKEND == "faster-whisper" else None,
+        beam_size=BEAM_SIZE,
+        language="ja",
+        vad_padding_ms=VAD_PADDING_MS,
+        chunk_seconds=CHUNK_SECONDS,
+        chunk_overlap_seconds=CHUNK_OVERLAP_SECONDS,
+        **options
+    )
+    result = cache.get(key)
+    if result is not None:
+        logger.info("Returning cached transcription")
+        return {**result, "cached": True}
+    result = speech_to_text(audio, **options)
+    cache.put(key, result)
+    return result
+
 @app.post("/asr")
-async def transcribe_audio(file: UploadFile = File(...)):
+async def transcribe_audio(
+    file: UploadFile = File(...),
+    vad: Optional[bool] = None,
+    vad_aggressiveness: Optional[int] = Query(None, ge=0, le=3),
+    vad_min_silence_ms: Optional[int] = Query(None, ge=0)
+):
     try:
         logger.info(f"Received audio file: {file.filename}, size: {file.size if hasattr(file, 'size') else 'unknown'}")
-        
-        # Save the uploaded file to a temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_filename = temp_file.name
-        
-        logger.info(f"Saved temporary file: {temp_filename}")
-        
-        # Process the audio file
-        text, confidence, language = speech_to_text(temp_filename)
-        
-        # Clean up
-        os.unlink(temp_filename)
-        
+
+        content = await file.read()
+        suffix = os.path.splitext(file.filename or "")[1] or ".wav"
+
+        # Decode in memory and process the audio
+        result = await asr_executor.run(
+            transcribe_bytes, content, suffix,
+            vad=vad, vad_aggressiveness=vad_aggressiveness, vad_min_silence_ms=vad_min_silence_ms
+        )
+
         logger.info("Transcription request completed successfully")
-        return ASRResponse(text=text, confidence=confidence, language=language)
+        return ASRResponse(**result)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in transcribe_audio endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing speech: {str(e)}")
 
 @app.post("/asr-base64")
-async def transcribe_audio_base64(audio_base64: str):
+async def transcribe_audio_base64(
+    audio_base64: str,
+    vad: Optional[bool] = None,
+    vad_aggressiveness: Optional[int] = Query(None, ge=0, le=3),
+    vad_min_silence_ms: Optional[int] = Query(None, ge=0)
+):
     try:
         logger.info("Received base64 audio data")
-        
+
         # Decode the base64 audio
         audio_data = base64.b64decode(audio_base64)
-        
-        # Save to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            temp_file.write(audio_data)
-            temp_filename = temp_file.name
-        
-        # Process the audio file
-        text, confidence, language = speech_to_text(temp_filename)
-        
-        # Clean up
-        os.unlink(temp_filename)
-        
-        return ASRResponse(text=text, confidence=confidence, language=language)
+
+        # Decode in memory and process the audio
+        result = await asr_executor.run(
+            transcribe_bytes, audio_data,
+            vad=vad, vad_aggressiveness=vad_aggressiveness, vad_min_silence_ms=vad_min_silence_ms
+        )
+
+        return ASRResponse(**result)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in transcribe_audio_base64 endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing speech: {str(e)}")
 
+def transcribe_window(audio: np.ndarray):
+    """Decode one streaming window; blocking, so it runs on the ASR executor."""
+    model = get_asr_model()
+    if model is None:
+        raise Exception("ASR model failed to initialize")
+    if len(audio) == 0:
+        return {"text": "", "segments": []}
+    return model.transcribe(audio, language="ja")
+
+@app.websocket("/asr/stream")
+async def transcribe_stream(websocket: WebSocket, sample_rate: int = SAMPLE_RATE):
+    """
+    Live transcription. The client sends binary frames of 16-bit little-endian
+    mono PCM at ``sample_rate`` and a text frame {"type": "end"} when done.
+    The server answers with {"type": "partial", ...} messages while audio
+    arrives and a {"type": "final", ...} message with segments at the end.
+    """
+    await websocket.accept()
+    transcriber = StreamingTranscriber(SAMPLE_RATE, STREAM_STEP_SECONDS, STREAM_WINDOW_SECONDS)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                frame = np.frombuffer(message["bytes"], dtype="<i2").astype(np.float32) / 32768.0
+                transcriber.feed(resample(frame, sample_rate))
+                if transcriber.duration > STREAM_MAX_SECONDS:
+                    await websocket.send_json({"type": "error", "detail": f"Stream exceeds {STREAM_MAX_SECONDS:.0f}s"})
+                    break
+                if transcriber.ready():
+                    result = await asr_executor.run(transcribe_window, transcriber.window())
+                    await websocket.send_json(transcriber.update(result))
+            elif message.get("text") and json.loads(message["text"]).get("type") == "end":
+                break
+
+        result = await asr_executor.run(transcribe_window, transcriber.window())
+        await websocket.send_json(transcriber.finish(result))
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("Streaming client disconnected")
+    except HTTPException as e:
+        # Executor busy or timed out
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close(code=1013)
+    except Exception as e:
+        logger.error(f"Error in transcribe_stream endpoint: {str(e)}")
+        await websocket.send_json({"type": "error", "detail": f"Error processing speech: {str(e)}"})
+        await websocket.close(code=1011)
+
+async def warm_up():
+    # Load Whisper on the executor in the background so /health answers immediately
+    try:
+        await asr_executor.run(get_asr_model, timeout=3600)
+    except Exception as e:
+        logger.error(f"Failed to initialize ASR model during startup: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    get_result_cache()
+    asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    asr_executor.shutdown()
+    chunk_pool.shutdown(wait=False, cancel_futures=True)
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "model": ASR_MODEL}
+    return {
+        "status": "healthy",
+        "model": ASR_MODEL,
+        "backend": ASR_BACKEND,
+        "model_loaded": _asr_model is not None,
+        "executor": asr_executor.stats(),
+        "vad": {"enabled": VAD_ENABLED, **vad_stats.stats()},
+        "result_cache": _result_cache.stats() if _result_cache else {"enabled": ASR_CACHE_ENABLED}
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,90 @@
+import logging
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ASR_BACKEND = os.getenv("ASR_BACKEND", "whisper")
+COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")  # faster-whisper only
+CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", 0))  # 0 lets the runtime decide
+BEAM_SIZE = int(os.getenv("ASR_BEAM_SIZE", 1))
+
+class WhisperBackend:
+    """openai-whisper running the float32 PyTorch model.
+
+    The model installs decoder hooks on every call, so one instance must not
+    decode on two threads at once.
+    """
+
+    name = "whisper"
+    thread_safe = False
+
+    def __init__(self, model_name: str, cpu_threads: int = CPU_THREADS, beam_size: int = BEAM_SIZE):
+        import whisper
+        if cpu_threads:
+            import torch
+            torch.set_num_threads(cpu_threads)
+        self.model_name = model_name
+        self.beam_size = beam_size
+        self.model = whisper.load_model(model_name)
+
+    def transcribe(self, audio: np.ndarray, language: str = "ja") -> Dict[str, Any]:
+        options = {"beam_size": self.beam_size} if self.beam_size > 1 else {}
+        result = self.model.transcribe(audio, language=language, task="transcribe", **options)
+        return {
+            "text": result["text"],
+            "language": result.get("language", language),
+            "segments": [
+                {"text": seg["text"], "start": seg["start"], "end": seg["end"]}
+                for seg in result.get("segments", [])
+            ]
+        }
+
+class FasterWhisperBackend:
+    """faster-whisper on CTranslate2, int8-quantized by default.
+
+    CTranslate2 handles concurrent calls itself (``num_workers`` of them in
+    parallel), so a single instance is shared across threads.
+    """
+
+    name = "faster-whisper"
+    thread_safe = True
+
+    def __init__(self, model_name: str, cpu_threads: int = CPU_THREADS, beam_size: int = BEAM_SIZE,
+                 compute_type: str = COMPUTE_TYPE, num_workers: int = 1):
+        from faster_whisper import WhisperModel
+        self.model_name = model_name
+        self.beam_size = beam_size
+        self.model = WhisperModel(
+            model_name,
+            device="cpu",
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers
+        )
+
+    def transcribe(self, audio: np.ndarray, language: str = "ja") -> Dict[str, Any]:
+        segments, info = self.model.transcribe(audio, language=language, task="transcribe", beam_size=self.beam_size)
+        # Segments are decoded lazily; materialize them while still on this thread
+        segments: List[Dict[str, Any]] = [
+            {"text": seg.text, "start": seg.start, "end": seg.end} for seg in segments
+        ]
+        return {
+            "text": "".join(seg["text"] for seg in segments),
+            "language": info.language or language,
+            "segments": segments
+        }
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+def create_backend(model_name: str, backend: str = ASR_BACKEND, **options):
+    """Instantiate the ASR backend selected by name (``ASR_BACKEND`` by default)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ASR backend '{backend}', expected one of: {', '.join(BACKENDS)}")
+    logger.info(f"Loading {backend} backend with model {model_name}")
+    return BACKENDS[backend](model_name, **options)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Compare ASR backends on a fixed set of local Japanese clips.
+
+The clip directory holds audio files (wav/flac/mp3/...) each with a
+reference transcript next to it under the same name with a .txt extension.
+For every backend the script reports the model load time, the real-time
+factor (processing time / audio duration, lower is faster) and the error
+rates against the references. Japanese is written without spaces, so the
+character error rate is the number to compare; the word error rate is only
+meaningful when the references are pre-tokenized with spaces.
+
+Example:
+    python benchmark.py --clips ./clips --backends whisper faster-whisper --model base
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, List, Sequence, Tuple
+
+import whisper
+
+from backends import BACKENDS, create_backend
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+
+def load_clips(clip_dir: str) -> List[Tuple[str, object, str]]:
+    """Return (name, 16 kHz audio, reference text) for every clip with a transcript."""
+    clips = []
+    for name in sorted(os.listdir(clip_dir)):
+        stem, ext = os.path.splitext(name)
+        reference_path = os.path.join(clip_dir, f"{stem}.txt")
+        if ext.lower() not in AUDIO_EXTENSIONS or not os.path.exists(reference_path):
+            continue
+        with open(reference_path, encoding="utf-8") as f:
+            reference = f.read().strip()
+        clips.append((name, whisper.load_audio(os.path.join(clip_dir, name), sr=SAMPLE_RATE), reference))
+    return clips
+
+def normalize(text: str) -> str:
+    """NFKC-normalize and drop punctuation so scoring ignores formatting differences."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[\s\W_]+", " ", text).strip()
+
+def edit_distance(reference: Sequence, hypothesis: Sequence) -> int:
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+def benchmark_backend(backend: str, clips, model: str, **options) -> Dict:
+    start = time.perf_counter()
+    engine = create_backend(model, backend=backend, **options)
+    load_seconds = time.perf_counter() - start
+
+    # Warm up on the first clip so one-off allocations don't skew the first timing
+    engine.transcribe(clips[0][1], language="ja")
+
+    audio_seconds = processing_seconds = 0.0
+    char_errors = char_total = word_errors = word_total = 0
+    per_clip = []
+    for name, audio, reference in clips:
+        start = time.perf_counter()
+        hypothesis = engine.transcribe(audio, language="ja")["text"]
+        elapsed = time.perf_counter() - start
+        duration = len(audio) / SAMPLE_RATE
+
+        ref, hyp = normalize(reference), normalize(hypothesis)
+        ref_chars, hyp_chars = ref.replace(" ", ""), hyp.replace(" ", "")
+        clip_char_errors = edit_distance(ref_chars, hyp_chars)
+        clip_word_errors = edit_distance(ref.split(), hyp.split())
+
+        audio_seconds += duration
+        processing_seconds += elapsed
+        char_errors += clip_char_errors
+        char_total += len(ref_chars)
+        word_errors += clip_word_errors
+        word_total += len(ref.split())
+        per_clip.append({
+            "clip": name,
+            "rtf": round(elapsed / duration, 3) if duration else None,
+            "cer": round(clip_char_errors / len(ref_chars), 3) if ref_chars else None,
+            "hypothesis": hypothesis.strip()
+        })
+
+    return {
+        "backend": backend,
+        "model": model,
+        "load_seconds": round(load_seconds, 2),
+        "audio_seconds": round(audio_seconds, 2),
+        "processing_seconds": round(processing_seconds, 2),
+        "rtf": round(processing_seconds / audio_seconds, 3) if audio_seconds else None,
+        "cer": round(char_errors / char_total, 3) if char_total else None,
+        "wer": round(word_errors / word_total, 3) if word_total else None,
+        "clips": per_clip
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ASR backends on local Japanese clips")
+    parser.add_argument("--clips", required=True, help="Directory of audio clips with matching .txt references")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS),
+                        help="Backends to compare")
+    parser.add_argument("--model", default=os.getenv("ASR_MODEL", "base"), help="Whisper model size")
+    parser.add_argument("--beam-size", type=int, default=1, help="Beam size (1 = greedy)")
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads (0 = runtime default)")
+    parser.add_argument("--compute-type", default="int8", help="CTranslate2 compute type for faster-whisper")
+    parser.add_argument("--output", help="Write the full results as JSON to this file")
+    args = parser.parse_args()
+
+    clips = load_clips(args.clips)
+    if not clips:
+        parser.error(f"No clips with .txt references found in {args.clips}")
+    print(f"Loaded {len(clips)} clips ({sum(len(c[1]) for c in clips) / SAMPLE_RATE:.1f}s of audio)")
+
+    results = []
+    for backend in args.backends:
+        options = {"beam_size": args.beam_size, "cpu_threads": args.threads}
+        if backend == "faster-whisper":
+            options["compute_type"] = args.compute_type
+        print(f"Running {backend}...")
+        results.append(benchmark_backend(backend, clips, args.model, **options))
+
+    print(f"\n{'backend':<16}{'load s':>8}{'RTF':>8}{'CER':>8}{'WER':>8}")
+    for result in results:
+        print(f"{result['backend']:<16}{result['load_seconds']:>8}{result['rtf']:>8}"
+              f"{str(result['cer']):>8}{str(result['wer']):>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nWrote results to {args.output}")
+
+if __name__ == "__main__":
+    main()
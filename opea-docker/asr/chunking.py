@@ -0,0 +1,74 @@
+from typing import Dict, List
+import numpy as np
+
+FRAME_SECONDS = 0.03  # Energy frame length used to find quiet cut points
+
+def quietest_point(audio: np.ndarray, sample_rate: int, center: int, search_seconds: float) -> int:
+    """Return the sample index of the lowest-energy frame within ``search_seconds`` of ``center``."""
+    frame = max(1, int(FRAME_SECONDS * sample_rate))
+    radius = int(search_seconds * sample_rate)
+    lo = max(0, center - radius)
+    hi = min(len(audio), center + radius)
+    window = audio[lo:hi]
+    n_frames = len(window) // frame
+    if n_frames < 2:
+        return center
+    energies = np.square(window[:n_frames * frame].reshape(n_frames, frame)).mean(axis=1)
+    return lo + int(np.argmin(energies)) * frame + frame // 2
+
+def plan_chunks(audio: np.ndarray, sample_rate: int, chunk_seconds: float, overlap_seconds: float,
+                search_seconds: float = 5.0) -> List[Dict[str, int]]:
+    """
+    Split audio into chunks cut at quiet points near every ``chunk_seconds``.
+
+    Each chunk owns the samples in ``[keep_start, keep_end)`` and is transcribed
+    over ``[start, end)``, which adds ``overlap_seconds`` of context on both sides
+    so words near a cut are heard in full by at least one chunk.
+    """
+    total = len(audio)
+    chunk = int(chunk_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+
+    cuts = [0]
+    nominal = chunk
+    while nominal < total - chunk // 4:
+        cuts.append(quietest_point(audio, sample_rate, nominal, search_seconds))
+        nominal = cuts[-1] + chunk
+    cuts.append(total)
+
+    return [
+        {
+            "start": max(0, keep_start - overlap),
+            "end": min(total, keep_end + overlap),
+            "keep_start": keep_start,
+            "keep_end": keep_end,
+        }
+        for keep_start, keep_end in zip(cuts, cuts[1:])
+    ]
+
+def merge_segments(chunks: List[Dict[str, int]], results: List[List[Dict]], sample_rate: int) -> List[Dict]:
+    """
+    Merge per-chunk Whisper segments into one timeline.
+
+    Segment times are shifted to the original audio, each segment is kept only
+    by the chunk that owns its midpoint, and a segment repeated verbatim across
+    a cut is dropped.
+    """
+    merged = []
+    for chunk, segments in zip(chunks, results):
+        offset = chunk["start"] / sample_rate
+        keep_start = chunk["keep_start"] / sample_rate
+        keep_end = chunk["keep_end"] / sample_rate
+        for segment in segments:
+            start = offset + float(segment["start"])
+            end = offset + float(segment["end"])
+            text = segment["text"].strip()
+            if not text or not keep_start <= (start + end) / 2 < keep_end:
+                continue
+            if merged and merged[-1]["text"] == text and start - merged[-1]["end"] < 1.0:
+                continue
+            merged.append({"text": text, "start": start, "end": end})
+    return merged
+
+def segments_to_text(segments: List[Dict]) -> str:
+    return "".join(segment["text"] for segment in segments)
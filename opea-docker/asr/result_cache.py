@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """SQLite-backed cache of transcription results.
+
+    Entries are keyed by a hash of the decoded 16 kHz PCM plus everything that
+    changes the output (backend, model, language, decode and VAD options), so
+    the same audio re-encoded or re-uploaded under another name still hits.
+    Least recently used rows are evicted once the stored results exceed
+    ``max_bytes``.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        logger.info(f"ASR result cache: {entries} entries, {self._total_bytes} bytes in {db_path}")
+
+    @staticmethod
+    def make_key(audio: np.ndarray, **options) -> str:
+        digest = hashlib.sha256(np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]):
+        data = json.dumps(result, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time())
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM results ORDER BY last_used LIMIT 32").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._total_bytes -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return {
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
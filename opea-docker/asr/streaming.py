@@ -0,0 +1,137 @@
+from typing import Any, Dict, List
+
+import numpy as np
+
+def common_prefix_length(a: str, b: str) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+class StreamingTranscriber:
+    """
+    Incremental transcription over a rolling audio window with local agreement.
+
+    Audio is appended as it arrives and the whole window is re-decoded every
+    ``step_seconds``. Text is committed once two consecutive decodes agree on
+    it (character-level, since Japanese has no word boundaries); the rest is
+    reported as tentative. When the window grows past ``window_seconds`` the
+    audio under fully committed segments is dropped so decode cost stays flat.
+
+    The class does no decoding itself: the caller runs the model on
+    :meth:`window` (on an executor) and passes the result to :meth:`update`.
+    """
+
+    def __init__(self, sample_rate: int = 16000, step_seconds: float = 1.0, window_seconds: float = 15.0):
+        self.sample_rate = sample_rate
+        self.step = int(step_seconds * sample_rate)
+        self.window_samples = int(window_seconds * sample_rate)
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_offset = 0.0  # seconds trimmed off the front of the stream so far
+        self.pending = 0  # samples received since the last decode
+        self.committed = ""  # text committed for the whole stream
+        self.window_committed = ""  # committed text that still belongs to the current window
+        self.previous_tail = ""  # uncommitted text from the last decode, for agreement
+        self.segments: List[Dict[str, Any]] = []  # committed segments trimmed from the window
+
+    def feed(self, audio: np.ndarray):
+        self.buffer = np.concatenate([self.buffer, audio.astype(np.float32)])
+        self.pending += len(audio)
+
+    @property
+    def duration(self) -> float:
+        return self.buffer_offset + len(self.buffer) / self.sample_rate
+
+    def ready(self) -> bool:
+        return self.pending >= self.step
+
+    def window(self) -> np.ndarray:
+        self.pending = 0
+        return self.buffer
+
+    @staticmethod
+    def _segments(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"text": seg["text"].strip(), "start": float(seg["start"]), "end": float(seg["end"])}
+            for seg in result["segments"]
+            if seg["text"].strip()
+        ]
+
+    def update(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a decode of :meth:`window` and return the partial result to send."""
+        segments = self._segments(result)
+        hypothesis = "".join(seg["text"] for seg in segments)
+
+        # Whatever the model now says past the committed text is the new tail; if it
+        # revised earlier words, skip the committed length anyway so nothing is emitted twice
+        tail = hypothesis[len(self.window_committed):]
+        agreed = common_prefix_length(tail, self.previous_tail)
+        self.window_committed += tail[:agreed]
+        self.committed += tail[:agreed]
+        self.previous_tail = tail[agreed:]
+
+        if len(self.buffer) > self.window_samples:
+            self._trim(segments)
+
+        return {
+            "type": "partial",
+            "committed": self.committed,
+            "tentative": self.previous_tail,
+            "text": self.committed + self.previous_tail,
+            "audio_seconds": round(self.duration, 2)
+        }
+
+    def _trim(self, segments: List[Dict[str, Any]]):
+        # Drop audio under the leading segments whose text is fully committed,
+        # always keeping the last segment since it may still change
+        consumed = 0
+        keep_from = 0
+        for i, seg in enumerate(segments[:-1]):
+            if consumed + len(seg["text"]) > len(self.window_committed):
+                break
+            consumed += len(seg["text"])
+            keep_from = i + 1
+        if keep_from == 0 and len(self.buffer) > 2 * self.window_samples:
+            # Nothing settled for far too long; force-commit so the window can't grow unbounded
+            self.committed += self.previous_tail
+            self.window_committed += self.previous_tail
+            self.previous_tail = ""
+            consumed = len(self.window_committed)
+            keep_from = len(segments)
+            cut = len(self.buffer)
+        elif keep_from == 0:
+            return
+        else:
+            cut = int(segments[keep_from - 1]["end"] * self.sample_rate)
+
+        for seg in segments[:keep_from]:
+            self.segments.append({
+                "text": seg["text"],
+                "start": self.buffer_offset + seg["start"],
+                "end": self.buffer_offset + seg["end"]
+            })
+        self.buffer = self.buffer[cut:]
+        self.buffer_offset += cut / self.sample_rate
+        self.window_committed = self.window_committed[consumed:]
+
+    def finish(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply the final decode of the remaining window and return the final result."""
+        segments = self._segments(result)
+        hypothesis = "".join(seg["text"] for seg in segments)
+        # The final decode is authoritative for everything still in the window
+        self.committed = self.committed[:len(self.committed) - len(self.window_committed)] + hypothesis
+        self.segments.extend(
+            {"text": seg["text"], "start": self.buffer_offset + seg["start"], "end": self.buffer_offset + seg["end"]}
+            for seg in segments
+        )
+        return {
+            "type": "final",
+            "text": self.committed,
+            "segments": [
+                {"text": seg["text"], "start": seg["start"], "duration": seg["end"] - seg["start"]}
+                for seg in self.segments
+            ],
+            "audio_seconds": round(self.duration, 2)
+        }
@@ -0,0 +1,123 @@
+import bisect
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# webrtcvad is the more robust detector; fall back to frame energy without it
+try:
+    import webrtcvad
+    webrtcvad_available = True
+except ImportError:
+    logger.info("webrtcvad not available, using energy-based voice activity detection")
+    webrtcvad_available = False
+
+FRAME_MS = 30  # webrtcvad accepts 10, 20 or 30 ms frames
+
+def _webrtc_flags(audio: np.ndarray, sample_rate: int, aggressiveness: int) -> np.ndarray:
+    vad = webrtcvad.Vad(int(aggressiveness))
+    frame = sample_rate * FRAME_MS // 1000
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+    n_frames = len(pcm) // frame
+    return np.array(
+        [vad.is_speech(pcm[i * frame:(i + 1) * frame].tobytes(), sample_rate) for i in range(n_frames)],
+        dtype=bool
+    )
+
+def _energy_flags(audio: np.ndarray, sample_rate: int, aggressiveness: int) -> np.ndarray:
+    frame = sample_rate * FRAME_MS // 1000
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+    energy = np.square(audio[:n_frames * frame].reshape(n_frames, frame)).mean(axis=1)
+    db = 10 * np.log10(energy + 1e-10)
+    # Speech sits well above the noise floor; never treat near-peak frames as silence
+    threshold = min(np.percentile(db, 10) + 6 + 3 * aggressiveness, db.max() - 30)
+    return db > max(threshold, -60)
+
+def speech_regions(audio: np.ndarray, sample_rate: int, aggressiveness: int = 2,
+                   min_silence_ms: int = 500, padding_ms: int = 200) -> List[Tuple[int, int]]:
+    """
+    Return ``(start, end)`` sample ranges that contain speech.
+
+    Each speech frame is padded by ``padding_ms`` on both sides so word onsets
+    and tails survive, and gaps shorter than ``min_silence_ms`` are bridged so
+    short pauses inside a sentence are kept.
+    """
+    if webrtcvad_available:
+        flags = _webrtc_flags(audio, sample_rate, aggressiveness)
+    else:
+        flags = _energy_flags(audio, sample_rate, aggressiveness)
+
+    frame = sample_rate * FRAME_MS // 1000
+    padding = padding_ms * sample_rate // 1000
+    min_gap = min_silence_ms * sample_rate // 1000
+    regions: List[List[int]] = []
+    for i in np.flatnonzero(flags):
+        start = max(0, int(i) * frame - padding)
+        end = min(len(audio), (int(i) + 1) * frame + padding)
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = max(regions[-1][1], end)
+        else:
+            regions.append([start, end])
+    return [(start, end) for start, end in regions]
+
+class TimeMap:
+    """Maps times in speech-only audio back to the original recording."""
+
+    def __init__(self, regions: List[Tuple[int, int]], sample_rate: int):
+        self.sample_rate = sample_rate
+        self._compact_starts: List[int] = []
+        self._original_starts: List[int] = []
+        offset = 0
+        for start, end in regions:
+            self._compact_starts.append(offset)
+            self._original_starts.append(start)
+            offset += end - start
+
+    def to_original(self, seconds: float, end: bool = False) -> float:
+        if not self._compact_starts:
+            return seconds
+        sample = int(round(seconds * self.sample_rate))
+        # An end time on a region boundary belongs to the region before it
+        search = bisect.bisect_left if end else bisect.bisect_right
+        i = max(0, search(self._compact_starts, sample) - 1)
+        return (self._original_starts[i] + sample - self._compact_starts[i]) / self.sample_rate
+
+def trim_silence(audio: np.ndarray, sample_rate: int, aggressiveness: int = 2,
+                 min_silence_ms: int = 500, padding_ms: int = 200) -> Tuple[np.ndarray, TimeMap]:
+    """Drop non-speech regions and return the speech-only audio with its time map."""
+    regions = speech_regions(audio, sample_rate, aggressiveness, min_silence_ms, padding_ms)
+    if not regions:
+        return audio[:0], TimeMap(regions, sample_rate)
+    speech = np.concatenate([audio[start:end] for start, end in regions])
+    return speech, TimeMap(regions, sample_rate)
+
+class VadStats:
+    """Running totals of how much audio the VAD stage kept out of Whisper."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+
+    def record(self, audio_seconds: float, speech_seconds: float):
+        with self._lock:
+            self.requests += 1
+            self.audio_seconds += audio_seconds
+            self.speech_seconds += speech_seconds
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            skipped = self.audio_seconds - self.speech_seconds
+            return {
+                "detector": "webrtcvad" if webrtcvad_available else "energy",
+                "requests": self.requests,
+                "audio_seconds": round(self.audio_seconds, 1),
+                "skipped_seconds": round(skipped, 1),
+                "skipped_share": round(skipped / self.audio_seconds, 3) if self.audio_seconds else 0.0
+            }
@@ -10,6 +10,8 @@ build_image() {
     # Copy the component directory and requirements to the temp directory
     cp -r ./$component/* $temp_dir/
     cp -r ../requirements $temp_dir/
+    # Copy shared service modules (inference executor, etc.)
+    cp -r ./common/* $temp_dir/
     # Build the image using the temp directory as context
     docker build --no-cache -t $image_name:latest $temp_dir
     # Clean up
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError as FutureCancelledError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+class SubmittedJob:
+    """Handle for a job queued with :meth:`InferenceExecutor.submit`.
+
+    Cancel through the handle rather than the underlying future so a job
+    dropped before it starts gives its queue slot back.
+    """
+
+    def __init__(self, executor: "InferenceExecutor", future, state: Dict[str, bool]):
+        self._executor = executor
+        self._state = state
+        self.future = future
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        return self.future.result(timeout)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self) -> bool:
+        """Drop the job if it hasn't started; returns True if it never will."""
+        self._executor._cancel(self.future, self._state)
+        return self._state["released"]
+
+class InferenceExecutor:
+    """Bounded worker pool that keeps blocking model inference off the event loop.
+
+    Each service creates one executor per model. At most ``max_workers`` jobs
+    run at once and at most ``max_queue`` more may wait; anything beyond that
+    is rejected with a 503 so clients back off instead of piling up. Jobs that
+    exceed ``timeout`` return a 504; queued jobs are cancelled outright, while
+    jobs already running on a worker are left to finish in the background
+    (PyTorch calls can't be interrupted safely).
+
+    Settings can be overridden per executor with ``<NAME>_WORKERS``,
+    ``<NAME>_QUEUE_SIZE`` and ``<NAME>_TIMEOUT`` environment variables.
+    """
+
+    def __init__(self, name: str, max_workers: int = 1, max_queue: int = 8, timeout: Optional[float] = None):
+        prefix = name.upper().replace("-", "_")
+        self.name = name
+        self.max_workers = int(os.getenv(f"{prefix}_WORKERS", max_workers))
+        self.max_queue = int(os.getenv(f"{prefix}_QUEUE_SIZE", max_queue))
+        timeout = os.getenv(f"{prefix}_TIMEOUT", timeout)
+        self.timeout = float(timeout) if timeout else None
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._cancelled = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def _admit(self):
+        with self._lock:
+            if self._queued >= self.max_queue + self.max_workers - self._active:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{self.name} is busy ({self._active} running, {self._queued} queued); retry later"
+                )
+            self._queued += 1
+
+    def _wrap(self, fn: Callable, args, kwargs, submitted: float, state: Dict[str, bool]):
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                if state["released"]:
+                    # Cancelled while waiting in the queue
+                    return None
+                state["started"] = True
+                self._queued -= 1
+                self._active += 1
+                self._total_wait += started - submitted
+            try:
+                result = fn(*args, **kwargs)
+                with self._lock:
+                    self._completed += 1
+                return result
+            except Exception:
+                with self._lock:
+                    self._failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._total_run += time.perf_counter() - started
+        return job
+
+    def _submit(self, fn: Callable, args, kwargs):
+        self._admit()
+        state = {"started": False, "released": False}
+        future = self._pool.submit(self._wrap(fn, args, kwargs, time.perf_counter(), state))
+        return future, state
+
+    def _cancel(self, future, state: Dict[str, bool]):
+        future.cancel()
+        with self._lock:
+            if not state["started"] and not state["released"]:
+                # Never started, so give back the queue slot the job was holding
+                state["released"] = True
+                self._queued -= 1
+                self._cancelled += 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` on a worker and await its result."""
+        future, state = self._submit(fn, args, kwargs)
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self._cancel(future, state)
+            with self._lock:
+                self._timed_out += 1
+            raise HTTPException(status_code=504, detail=f"{self.name} inference timed out after {timeout}s")
+        except (asyncio.CancelledError, FutureCancelledError):
+            # Client went away; drop the job if it hasn't started yet
+            self._cancel(future, state)
+            raise
+
+    def submit(self, fn: Callable, *args, **kwargs) -> SubmittedJob:
+        """Queue ``fn`` and return a :class:`SubmittedJob` without waiting (e.g. to stream from a worker)."""
+        future, state = self._submit(fn, args, kwargs)
+        return SubmittedJob(self, future, state)
+
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Blocking variant of :meth:`run` for code already running in a thread (e.g. streaming generators)."""
+        future, state = self._submit(fn, args, kwargs)
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self._cancel(future, state)
+            with self._lock:
+                self._timed_out += 1
+            raise HTTPException(status_code=504, detail=f"{self.name} inference timed out after {timeout}s")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "cancelled": self._cancelled,
+                "avg_wait_seconds": round(self._total_wait / finished, 4) if finished else 0.0,
+                "avg_run_seconds": round(self._total_run / finished, 4) if finished else 0.0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,20 +1,46 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Union
 import httpx
 import os
 import base64
+import gc
+import hashlib
 from enum import Enum
 from pathlib import Path
+import json
+import queue
+import resource
+import threading
+import time
 import torch
-from transformers import LlavaForConditionalGeneration, LlavaProcessor
+from transformers import LlavaForConditionalGeneration, LlavaProcessor, StoppingCriteriaList, TextIteratorStreamer
 from PIL import Image
 import io
+import asyncio
+
+from inference_executor import InferenceExecutor
+from generation import (
+    StopOnEvent, StopOnStrings, StopStringFilter, GenerationStats, strip_stop_strings, compute_image_features,
+    build_inputs_embeds
+)
+from feature_cache import FeatureCache
 
 # Configuration
 LLM_ENDPOINT = os.environ.get("LLM_ENDPOINT", "http://ollama-server:11434")
-VISION_MODEL_ID = os.environ.get("VISION_MODEL_ID", "llava-hf/llava-1.5-7b-hf")
+# The 7B model needs ~28 GB in float32, so CPU nodes rely on VISION_QUANT (int8 by
+# default) to shrink it. Smaller LLaVA variants such as llava-interleave-qwen-0.5b
+# can be set via VISION_CPU_MODEL_ID, but they use their own chat template and need
+# a newer transformers than the 4.39 this image pins
+GPU_MODEL_ID = "llava-hf/llava-1.5-7b-hf"
+CPU_MODEL_ID = os.environ.get("VISION_CPU_MODEL_ID", GPU_MODEL_ID)
+VISION_MODEL_ID = os.environ.get("VISION_MODEL_ID") or (GPU_MODEL_ID if torch.cuda.is_available() else CPU_MODEL_ID)
+# CPU weight format: "none" (float32), "bf16" or "int8" (dynamic quantization of Linear layers)
+VISION_QUANT = os.environ.get("VISION_QUANT", "int8").lower()
 MODEL_CACHE_DIR = os.environ.get("TRANSFORMERS_CACHE", "/app/data/llava_models")
+FEATURE_CACHE_MAX_BYTES = int(os.environ.get("VISION_FEATURE_CACHE_MB", 512)) * 1024 * 1024
+MAX_PROMPTS = int(os.environ.get("VISION_MAX_PROMPTS", 8))
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -22,6 +48,15 @@ app = FastAPI()
 # Global variables
 _llava_processor = None
 _llava_model = None
+model_stats: Dict[str, Any] = {}
+generation_stats = GenerationStats()
+
+# One generation at a time per model; a 7B model on CPU can't usefully share cores.
+# Queue depth and wait times are reported by vision_executor.stats() on /health.
+vision_executor = InferenceExecutor("vision", max_workers=1, max_queue=8, timeout=900)
+
+# Preprocessed images and vision-tower features, so follow-up prompts skip the encoder
+feature_cache = FeatureCache(FEATURE_CACHE_MAX_BYTES)
 
 # Models
 class VisionRequest(BaseModel):
@@ -36,82 +71,199 @@ class VisionResponse(BaseModel):
     content: str
     done: bool
 
+class MultiPromptRequest(BaseModel):
+    model: Optional[str] = None
+    prompts: List[str]
+    image: str
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = 1000
+
+class PromptAnswer(BaseModel):
+    prompt: str
+    content: str
+
+class MultiPromptResponse(BaseModel):
+    model: str
+    answers: List[PromptAnswer]
+    image_cached: bool
+    done: bool
+
+def load_llava(device: str):
+    """Load the processor and model for ``device``, applying VISION_QUANT on CPU."""
+    start = time.perf_counter()
+    processor = LlavaProcessor.from_pretrained(
+        VISION_MODEL_ID,
+        cache_dir=MODEL_CACHE_DIR
+    )
+    if device == "cuda":
+        dtype = torch.float16
+    else:
+        dtype = torch.bfloat16 if VISION_QUANT == "bf16" else torch.float32
+    model = LlavaForConditionalGeneration.from_pretrained(
+        VISION_MODEL_ID,
+        cache_dir=MODEL_CACHE_DIR,
+        torch_dtype=dtype,
+        low_cpu_mem_usage=True,
+        device_map="auto" if device == "cuda" else None
+    ).to(device)
+
+    if device == "cpu" and VISION_QUANT == "int8":
+        # Linear layers hold nearly all the weights; int8 dynamic quantization
+        # quarters their memory and speeds up the matmuls on CPU. Quantize in
+        # place so each fp32 layer is freed as it is replaced, instead of
+        # deep-copying the whole float32 model first
+        gc.collect()
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        gc.collect()
+    model.eval()
+
+    model_stats["load_seconds"] = round(time.perf_counter() - start, 2)
+    model_stats["device"] = device
+    model_stats["dtype"] = str(dtype).replace("torch.", "")
+    print(f"LLaVA model {VISION_MODEL_ID} loaded on {device} (quant={VISION_QUANT}) in {model_stats['load_seconds']}s")
+    return processor, model
+
 def get_llava_model():
     global _llava_processor, _llava_model
     if _llava_processor is None or _llava_model is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"Using device: {device}")
         try:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            print(f"Using device: {device}")
-            
-            _llava_processor = LlavaProcessor.from_pretrained(
-                VISION_MODEL_ID,
-                cache_dir=MODEL_CACHE_DIR
-            )
-            _llava_model = LlavaForConditionalGeneration.from_pretrained(
-                VISION_MODEL_ID,
-                cache_dir=MODEL_CACHE_DIR,
-                torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-                device_map="auto" if device == "cuda" else None
-            ).to(device)
-            
-            print(f"LLaVA model loaded successfully on {device}")
+            _llava_processor, _llava_model = load_llava(device)
         except Exception as e:
             print(f"Warning: LLaVA model initialization failed: {e}")
-            if device == "cuda":
-                print("Attempting to fall back to CPU...")
-                device = "cpu"
-                try:
-                    _llava_processor = LlavaProcessor.from_pretrained(
-                        VISION_MODEL_ID,
-                        cache_dir=MODEL_CACHE_DIR
-                    )
-                    _llava_model = LlavaForConditionalGeneration.from_pretrained(
-                        VISION_MODEL_ID,
-                        cache_dir=MODEL_CACHE_DIR,
-                        torch_dtype=torch.float32,
-                        device_map=None
-                    ).to(device)
-                    print("LLaVA model loaded successfully on CPU")
-                except Exception as e:
-                    print(f"Failed to load LLaVA model on CPU: {e}")
-                    raise e
+            if device != "cuda":
+                raise
+            print("Attempting to fall back to CPU...")
+            try:
+                _llava_processor, _llava_model = load_llava("cpu")
+            except Exception as e:
+                print(f"Failed to load LLaVA model on CPU: {e}")
+                raise e
     return _llava_processor, _llava_model
 
-@app.post("/vision")
-async def process_vision(request: VisionRequest):
-    try:
-        processor, model = get_llava_model()
-        if processor is None or model is None:
-            raise HTTPException(status_code=500, detail="LLaVA model not initialized")
+def format_prompt(processor, prompt: str) -> str:
+    """Wrap a question in the model's chat format, which differs between LLaVA variants."""
+    if getattr(processor, "chat_template", None):
+        conversation = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": prompt}]}]
+        return processor.apply_chat_template(conversation, add_generation_prompt=True)
+    return f"USER: <image>\n{prompt}\nASSISTANT:"
+
+def process_memory() -> Dict[str, float]:
+    """Current and peak resident memory of this process in MB."""
+    with open("/proc/self/statm") as f:
+        rss_pages = int(f.read().split()[1])
+    return {
+        "rss_mb": round(rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+def decode_image_bytes(image: str) -> bytes:
+    """Decode a base64 image, with or without a data: URL prefix."""
+    return base64.b64decode(image.split(",", 1)[1] if image.startswith("data:") else image)
+
+def get_image_inputs(processor, model, image: str):
+    """Return the cached pixel_values and vision features for an image, computing them on a miss."""
+    image_data = decode_image_bytes(image)
+    key = hashlib.sha256(image_data).hexdigest()
+    entry = feature_cache.get(key)
+    if entry is not None:
+        return entry, True
+
+    pil_image = Image.open(io.BytesIO(image_data)).convert('RGB')
+    pixel_values = processor.image_processor(pil_image, return_tensors="pt")["pixel_values"]
+    pixel_values = pixel_values.to(model.device, model.dtype)
+    with torch.no_grad():
+        features = compute_image_features(model, pixel_values)
+    entry = {"pixel_values": pixel_values, "features": features}
+    feature_cache.put(key, entry)
+    return entry, False
+
+def build_generation(image: str, prompts: List[str], temperature: Optional[float], max_tokens: int,
+                     stopping_criteria: Optional[list] = None):
+    """
+    Prepare generate() arguments for one image and one or more prompts.
+
+    The image goes through the vision tower once (or not at all on a cache
+    hit) and its features are spliced into each prompt's embeddings, so
+    generate() returns only the new tokens.
+    """
+    processor, model = get_llava_model()
+    if processor is None or model is None:
+        raise HTTPException(status_code=500, detail="LLaVA model not initialized")
+
+    entry, cached = get_image_inputs(processor, model, image)
+
+    # Format the prompts properly for LLaVA
+    prompts = [format_prompt(processor, prompt) for prompt in prompts]
+    with torch.no_grad():
+        inputs_embeds, attention_mask = build_inputs_embeds(processor.tokenizer, model, prompts, entry["features"])
+
+    generate_kwargs = dict(
+        inputs_embeds=inputs_embeds,
+        attention_mask=attention_mask,
+        max_new_tokens=max_tokens,
+        pad_token_id=processor.tokenizer.eos_token_id,
+        # End each answer as soon as the model starts another turn
+        stopping_criteria=StoppingCriteriaList(
+            [StopOnStrings(processor.tokenizer, 0)] + (stopping_criteria or [])
+        )
+    )
+    if temperature:
+        generate_kwargs.update(do_sample=True, temperature=temperature)
+    else:
+        generate_kwargs.update(do_sample=False)
+    return processor, model, generate_kwargs, cached
 
-        # Decode base64 image and convert to PIL Image
-        image_data = base64.b64decode(request.image.split(",")[1])
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
+def run_vision(request: VisionRequest) -> str:
+    """Run LLaVA generation for a request; blocking, so it runs on the vision executor."""
+    processor, model, generate_kwargs, _ = build_generation(
+        request.image, [request.prompt], request.temperature, request.max_tokens
+    )
 
-        # Format the prompt properly for LLaVA
-        prompt = f"USER: <image>\n{request.prompt}\nASSISTANT:"
+    # Generate response
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.generate(**generate_kwargs)
+    generation_stats.record(time.perf_counter() - start, outputs.shape[1])
 
-        # Process image and text
-        inputs = processor(
-            text=prompt,
-            images=image,
-            return_tensors="pt"
-        ).to(model.device)
+    # Output holds only the newly generated tokens, i.e. the assistant's response
+    return strip_stop_strings(processor.decode(outputs[0], skip_special_tokens=True))
 
-        # Generate response
+def run_vision_multi(request: MultiPromptRequest) -> Dict[str, Any]:
+    """Answer several prompts about one image in a single batched generate call."""
+    processor, model, generate_kwargs, cached = build_generation(
+        request.image, request.prompts, request.temperature, request.max_tokens
+    )
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.generate(**generate_kwargs)
+    generation_stats.record(time.perf_counter() - start, int((outputs != processor.tokenizer.eos_token_id).sum()))
+    answers = [strip_stop_strings(text) for text in processor.batch_decode(outputs, skip_special_tokens=True)]
+    return {"answers": answers, "image_cached": cached}
+
+def run_vision_stream(request: VisionRequest, streamer: TextIteratorStreamer, cancelled: threading.Event):
+    """Generate into ``streamer``; runs on the vision executor while the handler relays tokens."""
+    try:
+        _, model, generate_kwargs, _ = build_generation(
+            request.image, [request.prompt], request.temperature, request.max_tokens, [StopOnEvent(cancelled)]
+        )
+        start = time.perf_counter()
         with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=request.max_tokens,
-                temperature=request.temperature,
-                do_sample=True,
-                pad_token_id=processor.tokenizer.eos_token_id
-            )
-
-        # Decode response and extract only the assistant's response
-        full_response = processor.decode(outputs[0], skip_special_tokens=True)
-        # Extract only the assistant's response (after "ASSISTANT:")
-        response_text = full_response.split("ASSISTANT:")[-1].strip()
+            outputs = model.generate(**generate_kwargs, streamer=streamer)
+        generation_stats.record(time.perf_counter() - start, outputs.shape[1])
+    except Exception:
+        # Unblock the reader; the error is reported from the future
+        streamer.end()
+        raise
+
+def sse(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.post("/vision")
+async def process_vision(request: VisionRequest):
+    try:
+        response_text = await vision_executor.run(run_vision, request)
 
         return VisionResponse(
             model=VISION_MODEL_ID,
@@ -119,9 +271,80 @@ async def process_vision(request: VisionRequest):
             done=True
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+@app.post("/vision/multi")
+async def process_vision_multi(request: MultiPromptRequest):
+    """Answer several questions about one image; the image is encoded once for all of them."""
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="At least one prompt is required")
+    if len(request.prompts) > MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"Too many prompts. Maximum is {MAX_PROMPTS} per request.")
+    try:
+        result = await vision_executor.run(run_vision_multi, request)
+
+        return MultiPromptResponse(
+            model=VISION_MODEL_ID,
+            answers=[PromptAnswer(prompt=prompt, content=answer) for prompt, answer in zip(request.prompts, result["answers"])],
+            image_cached=result["image_cached"],
+            done=True
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+@app.post("/vision/stream")
+def process_vision_stream(request: VisionRequest):
+    """
+    Stream the answer as server-sent events while it is generated. Each event
+    carries a content delta; the last one has done=true (or an error).
+    """
+    # Loading the model here would block a server thread for minutes
+    if _llava_processor is None or _llava_model is None:
+        raise HTTPException(status_code=503, detail="LLaVA model is still loading, retry shortly")
+
+    streamer = TextIteratorStreamer(
+        _llava_processor.tokenizer,
+        skip_prompt=True,
+        skip_special_tokens=True,
+        timeout=vision_executor.timeout
+    )
+    cancelled = threading.Event()
+    job = vision_executor.submit(run_vision_stream, request, streamer, cancelled)
+
+    def events():
+        stop_filter = StopStringFilter()
+        started = False
+        try:
+            for text in streamer:
+                delta = stop_filter.feed(text)
+                if not started:
+                    delta = delta.lstrip()
+                    started = bool(delta)
+                if delta:
+                    yield sse({"content": delta, "done": False})
+            tail = stop_filter.flush().rstrip()
+            if tail:
+                yield sse({"content": tail, "done": False})
+            job.result()
+            yield sse({"model": VISION_MODEL_ID, "content": "", "done": True})
+        except queue.Empty:
+            # Cancel through the handle so a job still queued gives its executor slot back
+            job.cancel()
+            yield sse({"error": f"vision inference timed out after {vision_executor.timeout}s", "done": True})
+        except Exception as e:
+            yield sse({"error": f"Error processing image: {getattr(e, 'detail', str(e))}", "done": True})
+        finally:
+            # Client gone or stream finished; stop generating either way
+            cancelled.set()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/upload-image")
 async def upload_image(file: UploadFile = File(...)):
     try:
@@ -131,6 +354,21 @@ async def upload_image(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+async def warm_up():
+    # Load LLaVA on the executor in the background so /health answers immediately
+    try:
+        await vision_executor.run(get_llava_model, timeout=3600)
+    except Exception as e:
+        print(f"Warning: LLaVA warm-up failed: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    vision_executor.shutdown()
+
 @app.get("/health")
 async def health_check():
     try:
@@ -139,15 +377,20 @@ async def health_check():
             response = await client.get(f"{LLM_ENDPOINT}/api/version")
             ollama_status = "connected" if response.status_code == 200 else "disconnected"
 
-        # Check LLaVA status
-        processor, model = get_llava_model()
-        llava_status = "initialized" if processor is not None and model is not None else "not initialized"
+        # Check LLaVA status without loading the model on the event loop
+        llava_status = "initialized" if _llava_processor is not None and _llava_model is not None else "not initialized"
 
         return {
             "status": "healthy",
             "ollama_status": ollama_status,
             "model": VISION_MODEL_ID,
-            "llava_status": llava_status
+            "quantization": VISION_QUANT,
+            "llava_status": llava_status,
+            "model_info": model_stats,
+            "memory": process_memory(),
+            "latency": generation_stats.stats(),
+            "executor": vision_executor.stats(),
+            "feature_cache": feature_cache.stats()
         }
     except Exception as e:
         return {
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+
+def tensor_bytes(tensor: torch.Tensor) -> int:
+    return tensor.element_size() * tensor.numel()
+
+class FeatureCache:
+    """LRU cache of per-image LLaVA inputs keyed by a hash of the image bytes.
+
+    Each entry holds the processor's ``pixel_values`` and the projected
+    vision-tower features, so repeated prompts about the same image skip
+    decoding, preprocessing and the vision encoder. Entries are evicted
+    least-recently-used first to stay within ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, torch.Tensor]]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: str, entry: Dict[str, torch.Tensor]):
+        size = sum(tensor_bytes(tensor) for tensor in entry.values())
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._total_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = entry
+            self._sizes[key] = size
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,163 @@
+import threading
+from typing import Any, Dict, List, Tuple
+
+import torch
+from transformers import StoppingCriteria
+
+# LLaVA 1.5 is trained on "USER: ... ASSISTANT: ..." turns; once the model
+# starts a new turn the answer is over
+STOP_STRINGS = ["ASSISTANT:", "USER:"]
+
+class StopOnStrings(StoppingCriteria):
+    """Stop each sequence as soon as its newest tokens contain a turn marker."""
+
+    def __init__(self, tokenizer, prompt_length: int, stop_strings: List[str] = STOP_STRINGS, lookback: int = 8):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_strings = stop_strings
+        self.lookback = lookback
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        start = max(self.prompt_length, input_ids.shape[1] - self.lookback)
+        tails = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+        return torch.tensor(
+            [any(stop in tail for stop in self.stop_strings) for tail in tails],
+            dtype=torch.bool,
+            device=input_ids.device
+        )
+
+def strip_stop_strings(text: str, stop_strings: List[str] = STOP_STRINGS) -> str:
+    """Cut generated text at the first turn marker."""
+    cut = min((i for i in (text.find(stop) for stop in stop_strings) if i >= 0), default=len(text))
+    return text[:cut].strip()
+
+class StopStringFilter:
+    """
+    Streaming counterpart of :func:`strip_stop_strings`.
+
+    Text that could be the beginning of a stop string is held back until the
+    next chunk shows whether it is one, so a partial "USER" never reaches the
+    client.
+    """
+
+    def __init__(self, stop_strings: List[str] = STOP_STRINGS):
+        self.stop_strings = stop_strings
+        self.buffer = ""
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        self.buffer += text
+        hits = [i for i in (self.buffer.find(stop) for stop in self.stop_strings) if i >= 0]
+        if hits:
+            self.stopped = True
+            out, self.buffer = self.buffer[:min(hits)], ""
+            return out
+
+        hold = 0
+        for stop in self.stop_strings:
+            for k in range(min(len(stop) - 1, len(self.buffer)), hold, -1):
+                if self.buffer.endswith(stop[:k]):
+                    hold = k
+                    break
+        out, self.buffer = self.buffer[:len(self.buffer) - hold], self.buffer[len(self.buffer) - hold:]
+        return out
+
+    def flush(self) -> str:
+        out, self.buffer = ("" if self.stopped else self.buffer), ""
+        return out
+
+class StopOnEvent(StoppingCriteria):
+    """Stop generation when ``event`` is set, e.g. after a streaming client disconnects."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+def image_token_id(model) -> int:
+    config = model.config
+    return getattr(config, "image_token_id", None) or config.image_token_index
+
+def compute_image_features(model, pixel_values: torch.Tensor) -> torch.Tensor:
+    """Run the vision tower and projector; returns (1, image_tokens, hidden_size)."""
+    config = model.config
+    try:
+        features = model.get_image_features(
+            pixel_values=pixel_values,
+            vision_feature_layer=config.vision_feature_layer,
+            vision_feature_select_strategy=config.vision_feature_select_strategy
+        )
+    except (AttributeError, TypeError):
+        # Older transformers: do what LlavaForConditionalGeneration.forward does
+        hidden = model.vision_tower(pixel_values, output_hidden_states=True).hidden_states[config.vision_feature_layer]
+        if config.vision_feature_select_strategy == "default":
+            hidden = hidden[:, 1:]
+        features = model.multi_modal_projector(hidden)
+    if isinstance(features, (list, tuple)):
+        features = torch.stack(list(features))
+    if features.dim() == 2:
+        features = features.unsqueeze(0)
+    return features
+
+def build_inputs_embeds(tokenizer, model, prompts: List[str], features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Build left-padded input embeddings for one image and several prompts.
+
+    Each prompt's ``<image>`` token is expanded to one placeholder per image
+    feature and the placeholders' embeddings are replaced by ``features``,
+    which is what the model does internally from ``pixel_values``. Passing
+    the result as ``inputs_embeds`` lets generate() skip the vision tower.
+    """
+    token_id = image_token_id(model)
+    n_image_tokens = features.shape[1]
+    rows = []
+    for prompt in prompts:
+        ids = tokenizer(prompt, return_tensors="pt").input_ids[0]
+        positions = (ids == token_id).nonzero()
+        if len(positions) != 1:
+            raise ValueError("Prompt must contain exactly one <image> token")
+        pos = positions[0].item()
+        rows.append(torch.cat([ids[:pos], torch.full((n_image_tokens,), token_id, dtype=ids.dtype), ids[pos + 1:]]))
+
+    length = max(len(row) for row in rows)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    input_ids = torch.full((len(rows), length), pad_id, dtype=rows[0].dtype)
+    attention_mask = torch.zeros((len(rows), length), dtype=torch.long)
+    for i, row in enumerate(rows):
+        input_ids[i, length - len(row):] = row
+        attention_mask[i, length - len(row):] = 1
+
+    input_ids = input_ids.to(model.device)
+    embeds = model.get_input_embeddings()(input_ids)
+    image_mask = (input_ids == token_id).unsqueeze(-1).expand_as(embeds)
+    embeds = embeds.masked_scatter(image_mask, features.to(embeds.device, embeds.dtype).repeat(len(rows), 1, 1))
+    return embeds, attention_mask.to(model.device)
+
+class GenerationStats:
+    """Running generation latency and throughput for /health."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_seconds = 0.0
+        self.total_tokens = 0
+        self.last_seconds = None
+
+    def record(self, seconds: float, tokens: int):
+        with self._lock:
+            self.requests += 1
+            self.total_seconds += seconds
+            self.total_tokens += tokens
+            self.last_seconds = round(seconds, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "last_seconds": self.last_seconds,
+                "avg_seconds": round(self.total_seconds / self.requests, 2) if self.requests else None,
+                "tokens_per_second": round(self.total_tokens / self.total_seconds, 2) if self.total_seconds else None
+            }
@@ -1,6 +1,6 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple, Dict, Any
 import httpx
 import os
 import json
@@ -9,8 +9,13 @@ import asyncio
 import shutil
 from pathlib import Path
 import subprocess
+import time
 from contextlib import asynccontextmanager
 
+from sessions import session_store, context_window, SESSION_TOKEN_BUDGET, SESSION_KEEP_ALIVE
+from metrics import build_usage, normalize_caller, record_request, record_route, render_metrics
+from routing import model_router, SMALL_MODEL
+
 # Constants
 LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "http://ollama-server:11434")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "llama3.2")
@@ -32,17 +37,44 @@ class ChatRequest(BaseModel):
     messages: List[Message]
     temperature: Optional[float] = 0.7
     stream: Optional[bool] = True  # Default to streaming
+    session_id: Optional[str] = None  # Keep history server-side; send only the new turns
+    max_context_tokens: Optional[int] = None  # Per-session history budget override
+    caller: Optional[str] = None  # Metrics label (known apps only, else "other"); falls back to the X-Caller header
+    task_class: Optional[str] = None  # e.g. "classification", "extraction", "translation"
+    max_tokens: Optional[int] = None  # Generation cap; small values are routed to the small model
+    quality: Optional[str] = None  # "high" forces the default model, "fast" forces the small one
+
+class Usage(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    load_duration_ms: float = 0.0
+    prompt_eval_duration_ms: float = 0.0
+    eval_duration_ms: float = 0.0
+    total_duration_ms: float = 0.0
+    queue_wait_ms: float = 0.0
+    prompt_tokens_per_second: Optional[float] = None
+    tokens_per_second: Optional[float] = None
 
 class ChatResponse(BaseModel):
     model: str
     message: Message
     done: bool
+    session_id: Optional[str] = None
+    usage: Optional[Usage] = None
+    tier: Optional[str] = None
 
 # Initialize FastAPI app
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     if not USE_LOCAL:
         await ensure_model_exists(DEFAULT_MODEL)
+        if model_router.enabled and SMALL_MODEL != DEFAULT_MODEL:
+            try:
+                await ensure_model_exists(SMALL_MODEL)
+            except Exception as e:
+                print(f"Small model {SMALL_MODEL} unavailable, routing disabled: {str(e)}")
+                model_router.enabled = False
     yield
 
 app = FastAPI(lifespan=lifespan)
@@ -139,91 +171,147 @@ async def ensure_model_exists(model_name: str):
         print(f"Error ensuring model exists: {str(e)}")
         raise
 
+async def call_ollama_chat(payload: dict) -> Tuple[str, Dict[str, Any]]:
+    """Send a chat request to Ollama and return the assistant's content and timing counters."""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{LLM_ENDPOINT}/api/chat",
+            json=payload
+        )
+
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"LLM service error: {response.text}"
+            )
+
+        if payload["stream"]:
+            # Handle streaming response
+            content = ""
+            stats = {}
+            async for line in response.aiter_lines():
+                if line:
+                    try:
+                        chunk = json.loads(line)
+                        if "message" in chunk and "content" in chunk["message"]:
+                            content += chunk["message"]["content"]
+                        if chunk.get("done", False):
+                            # The final chunk carries the timing counters
+                            stats = chunk
+                            break
+                    except json.JSONDecodeError:
+                        continue
+
+            if not content:
+                raise HTTPException(
+                    status_code=500,
+                    detail="No valid response content received from LLM service"
+                )
+            return content, stats
+
+        # Handle non-streaming response
+        result = response.json()
+
+        # Handle different response formats
+        if "message" in result:  # Ollama chat API
+            return result["message"]["content"], result
+        elif "response" in result:  # Ollama generate API (fallback)
+            return result["response"], result
+        raise HTTPException(
+            status_code=500,
+            detail=f"Unexpected response format from LLM service: {result}"
+        )
+
 @app.post("/v1/chat/completions")
-async def chat_completion(request: ChatRequest):
+async def chat_completion(request: ChatRequest, http_request: Request):
+    started = time.perf_counter()
+    model, tier = model_router.route(request.model, request.task_class, request.max_tokens, request.quality)
+    caller = normalize_caller(request.caller or http_request.headers.get("X-Caller"))
     try:
         # Format messages for Ollama
-        ollama_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        ollama_messages = [{"role": msg.role.value, "content": msg.content} for msg in request.messages]
 
         # Prepare the request for Ollama
         payload = {
-            "model": request.model or DEFAULT_MODEL,
+            "model": model,
             "messages": ollama_messages,
             "stream": request.stream,  # Use the stream parameter from the request
             "temperature": request.temperature
         }
+        if request.max_tokens:
+            payload["options"] = {"num_predict": request.max_tokens}
 
-        # Make request to Ollama
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{LLM_ENDPOINT}/api/chat",
-                json=payload
-            )
+        if request.session_id:
+            # Session-scoped chat: the client only sends new turns, the history lives here
+            session = session_store.get_or_create(request.session_id, model)
+            budget = request.max_context_tokens or SESSION_TOKEN_BUDGET
+            # Size Ollama's window to the budget; its default (2048-4096) would cut the head of
+            # the prompt, system prompt included, and shift the cached prefix every turn
+            payload.setdefault("options", {})["num_ctx"] = context_window(budget, request.max_tokens)
+            async with session.lock:
+                history = list(session.messages)
+                session.append(ollama_messages)
+                session.trim(budget)
+                payload["messages"] = session.messages
+                # Keep the model (and its KV cache for the shared prefix) resident between turns
+                payload["keep_alive"] = SESSION_KEEP_ALIVE
+                try:
+                    content, stats = await call_ollama_chat(payload)
+                except Exception:
+                    session.messages = history
+                    raise
+                session.append([{"role": Role.ASSISTANT.value, "content": content}])
+        else:
+            content, stats = await call_ollama_chat(payload)
 
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"LLM service error: {response.text}"
-                )
+        wall_seconds = time.perf_counter() - started
+        usage = build_usage(stats, wall_seconds)
+        record_request(model, caller, usage, wall_seconds)
+        record_route(tier, request.task_class, wall_seconds)
 
-            if request.stream:
-                # Handle streaming response
-                content = ""
-                async for line in response.aiter_lines():
-                    if line:
-                        try:
-                            chunk = json.loads(line)
-                            if "message" in chunk and "content" in chunk["message"]:
-                                content += chunk["message"]["content"]
-                            if chunk.get("done", False):
-                                break
-                        except json.JSONDecodeError:
-                            continue
-
-                if not content:
-                    raise HTTPException(
-                        status_code=500,
-                        detail="No valid response content received from LLM service"
-                    )
-
-                return ChatResponse(
-                    model=request.model or DEFAULT_MODEL,
-                    message=Message(
-                        role=Role.ASSISTANT,
-                        content=content
-                    ),
-                    done=True
-                )
-            else:
-                # Handle non-streaming response
-                result = response.json()
-                
-                # Handle different response formats
-                if "message" in result:  # Ollama chat API
-                    content = result["message"]["content"]
-                elif "response" in result:  # Ollama generate API (fallback)
-                    content = result["response"]
-                else:
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Unexpected response format from LLM service: {result}"
-                    )
-
-                return ChatResponse(
-                    model=request.model or DEFAULT_MODEL,
-                    message=Message(
-                        role=Role.ASSISTANT,
-                        content=content
-                    ),
-                    done=True
-                )
+        return ChatResponse(
+            model=model,
+            message=Message(
+                role=Role.ASSISTANT,
+                content=content
+            ),
+            done=True,
+            session_id=request.session_id,
+            usage=Usage(**usage),
+            tier=tier
+        )
 
     except Exception as e:
+        record_request(model, caller, None, time.perf_counter() - started, status="error")
         raise HTTPException(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
         )
 
+@app.get("/v1/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {
+        "session_id": session.session_id,
+        "model": session.model,
+        "messages": session.messages,
+        "estimated_tokens": session.token_count(),
+        "trim_count": session.trim_count
+    }
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"session_id": session_id, "deleted": True}
+
+@app.get("/metrics")
+async def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
     try:
@@ -235,7 +323,14 @@ async def health_check():
                     "status": "healthy", 
                     "ollama_status": "connected", 
                     "default_model": DEFAULT_MODEL,
-                    "use_local": USE_LOCAL
+                    "use_local": USE_LOCAL,
+                    "routing": {
+                        "enabled": model_router.enabled,
+                        "models": model_router.models,
+                        "small_task_classes": sorted(model_router.small_task_classes),
+                        "overrides": model_router.overrides
+                    },
+                    "active_sessions": len(session_store)
                 }
             return {"status": "degraded", "ollama_status": "disconnected"}
     except Exception as e:
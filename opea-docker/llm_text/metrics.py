@@ -0,0 +1,131 @@
+import os
+from typing import Any, Dict, Optional
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+NANOSECONDS = 1_000_000_000
+# The caller label comes from clients, so only these values are kept; anything else is "other"
+KNOWN_CALLERS = {
+    name.strip().lower().replace("_", "-")
+    for name in os.getenv(
+        "METRICS_CALLERS",
+        "lang-portal,listening-speaking,sentence-constructor,visual-novel,vocabulary-generator,writing-practice"
+    ).split(",")
+    if name.strip()
+}
+
+REQUESTS = Counter(
+    "llm_requests_total",
+    "Chat requests handled by the gateway",
+    ["model", "caller", "status"]
+)
+PROMPT_TOKENS = Counter(
+    "llm_prompt_tokens_total",
+    "Prompt tokens evaluated by Ollama",
+    ["model", "caller"]
+)
+COMPLETION_TOKENS = Counter(
+    "llm_completion_tokens_total",
+    "Tokens generated by Ollama",
+    ["model", "caller"]
+)
+GENERATION_TPS = Histogram(
+    "llm_generation_tokens_per_second",
+    "Generation speed (eval_count / eval_duration)",
+    ["model", "caller"],
+    buckets=(1, 2, 5, 10, 20, 40, 80, 160, 320)
+)
+PROMPT_TPS = Histogram(
+    "llm_prompt_tokens_per_second",
+    "Prompt evaluation speed (prompt_eval_count / prompt_eval_duration)",
+    ["model", "caller"],
+    buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time between the gateway receiving a request and Ollama starting work on it",
+    ["model", "caller"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+LOAD_DURATION = Histogram(
+    "llm_load_duration_seconds",
+    "Model load time reported by Ollama",
+    ["model", "caller"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "End-to-end request time at the gateway",
+    ["model", "caller"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+ROUTED_REQUESTS = Counter(
+    "llm_routed_requests_total",
+    "Requests per routing tier and declared task class",
+    ["tier", "task_class"]
+)
+TIER_LATENCY = Histogram(
+    "llm_tier_request_duration_seconds",
+    "End-to-end request time per routing tier, for comparing small and large models",
+    ["tier", "task_class"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+
+def _rate(count: int, duration_ns: int) -> Optional[float]:
+    if not count or not duration_ns:
+        return None
+    return count / (duration_ns / NANOSECONDS)
+
+def build_usage(stats: Dict[str, Any], wall_seconds: float) -> Dict[str, Any]:
+    """Turn Ollama's final-chunk timing counters into a usage block.
+
+    Ollama reports durations in nanoseconds; the usage block uses milliseconds.
+    Queue wait is the part of the wall time Ollama didn't account for, i.e.
+    time spent in the gateway, on the wire and in Ollama's scheduler queue.
+    """
+    prompt_tokens = stats.get("prompt_eval_count", 0) or 0
+    completion_tokens = stats.get("eval_count", 0) or 0
+    total_ns = stats.get("total_duration", 0) or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "load_duration_ms": (stats.get("load_duration", 0) or 0) / 1_000_000,
+        "prompt_eval_duration_ms": (stats.get("prompt_eval_duration", 0) or 0) / 1_000_000,
+        "eval_duration_ms": (stats.get("eval_duration", 0) or 0) / 1_000_000,
+        "total_duration_ms": total_ns / 1_000_000,
+        "queue_wait_ms": max(0.0, wall_seconds - total_ns / NANOSECONDS) * 1000,
+        "prompt_tokens_per_second": _rate(prompt_tokens, stats.get("prompt_eval_duration", 0)),
+        "tokens_per_second": _rate(completion_tokens, stats.get("eval_duration", 0)),
+    }
+
+def normalize_caller(caller: Optional[str]) -> str:
+    """Map a client-supplied caller name onto a bounded set of label values."""
+    if not caller:
+        return "unknown"
+    name = caller.strip().lower().replace("_", "-")
+    return name if name in KNOWN_CALLERS else "other"
+
+def record_request(model: str, caller: str, usage: Optional[Dict[str, Any]], wall_seconds: float, status: str = "success"):
+    """Record a finished request in the Prometheus collectors."""
+    REQUESTS.labels(model, caller, status).inc()
+    REQUEST_DURATION.labels(model, caller).observe(wall_seconds)
+    if not usage:
+        return
+    PROMPT_TOKENS.labels(model, caller).inc(usage["prompt_tokens"])
+    COMPLETION_TOKENS.labels(model, caller).inc(usage["completion_tokens"])
+    QUEUE_WAIT.labels(model, caller).observe(usage["queue_wait_ms"] / 1000)
+    LOAD_DURATION.labels(model, caller).observe(usage["load_duration_ms"] / 1000)
+    if usage["tokens_per_second"] is not None:
+        GENERATION_TPS.labels(model, caller).observe(usage["tokens_per_second"])
+    if usage["prompt_tokens_per_second"] is not None:
+        PROMPT_TPS.labels(model, caller).observe(usage["prompt_tokens_per_second"])
+
+def record_route(tier: str, task_class: Optional[str], wall_seconds: float):
+    """Record which tier served a request and how long it took."""
+    task_class = task_class or "undeclared"
+    ROUTED_REQUESTS.labels(tier, task_class).inc()
+    TIER_LATENCY.labels(tier, task_class).observe(wall_seconds)
+
+def render_metrics():
+    """Return the Prometheus exposition payload and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,73 @@
+import os
+from typing import Dict, Optional, Tuple
+
+# Routing configuration
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "llama3.2")
+SMALL_MODEL = os.getenv("SMALL_MODEL", "llama3.2:1b")
+SMALL_TASK_CLASSES = [
+    t.strip() for t in os.getenv(
+        "SMALL_TASK_CLASSES", "classification,extraction,validation,translation,grading"
+    ).split(",") if t.strip()
+]
+SMALL_MAX_TOKENS = int(os.getenv("SMALL_MAX_TOKENS", 256))  # max_tokens at or below this goes to the small tier
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "True").lower() in ("true", "1", "t")
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+def parse_overrides(value: str) -> Dict[str, str]:
+    """Parse ``task=tier`` pairs, e.g. ``grading=large,translation=small``."""
+    overrides = {}
+    for pair in value.split(","):
+        if "=" not in pair:
+            continue
+        task, tier = (part.strip() for part in pair.split("=", 1))
+        if tier in (TIER_SMALL, TIER_LARGE):
+            overrides[task] = tier
+    return overrides
+
+# Per-route quality overrides, checked before the task class list
+ROUTE_OVERRIDES = parse_overrides(os.getenv("ROUTE_OVERRIDES", ""))
+
+class ModelRouter:
+    def __init__(self):
+        self.enabled = ROUTING_ENABLED and bool(SMALL_MODEL)
+        self.models = {TIER_SMALL: SMALL_MODEL, TIER_LARGE: DEFAULT_MODEL}
+        self.small_task_classes = set(SMALL_TASK_CLASSES)
+        self.small_max_tokens = SMALL_MAX_TOKENS
+        self.overrides = dict(ROUTE_OVERRIDES)
+
+    def select_tier(self, task_class: Optional[str], max_tokens: Optional[int], quality: Optional[str]) -> str:
+        """Pick a tier from the caller's hints.
+
+        An explicit ``quality`` on the request wins, then the per-route
+        override for the task class, then the task class list and finally
+        the max-tokens hint. Anything undeclared stays on the large tier.
+        """
+        if quality == "high":
+            return TIER_LARGE
+        if quality == "fast":
+            return TIER_SMALL
+        if task_class and task_class in self.overrides:
+            return self.overrides[task_class]
+        if task_class and task_class in self.small_task_classes:
+            return TIER_SMALL
+        if max_tokens is not None and max_tokens <= self.small_max_tokens:
+            return TIER_SMALL
+        return TIER_LARGE
+
+    def route(self, requested_model: Optional[str], task_class: Optional[str] = None,
+              max_tokens: Optional[int] = None, quality: Optional[str] = None) -> Tuple[str, str]:
+        """Return the (model, tier) a request should run on.
+
+        A caller that pins a model other than the default is never rerouted.
+        """
+        if requested_model and requested_model != DEFAULT_MODEL:
+            return requested_model, "pinned"
+        if not self.enabled:
+            return DEFAULT_MODEL, TIER_LARGE
+        tier = self.select_tier(task_class, max_tokens, quality)
+        return self.models[tier], tier
+
+# Create a global router instance
+model_router = ModelRouter()
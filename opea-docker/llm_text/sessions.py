@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+# Session configuration
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", 3072))
+SESSION_TRIM_RATIO = float(os.getenv("SESSION_TRIM_RATIO", 0.6))
+SESSION_TTL = int(os.getenv("SESSION_TTL", 1800))  # Seconds of inactivity before a session is dropped
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 256))
+SESSION_KEEP_ALIVE = os.getenv("SESSION_KEEP_ALIVE", "30m")  # Passed to Ollama as keep_alive
+# Room left in the context window for the reply; num_ctx = budget + this
+SESSION_RESPONSE_TOKENS = int(os.getenv("SESSION_RESPONSE_TOKENS", 1024))
+
+def estimate_tokens(text: str) -> int:
+    """
+    Conservative token estimate: about 4 ASCII characters per token, but one
+    token per non-ASCII character, since Japanese kana and kanji are roughly
+    a token each. Over-counting only trims a little early; under-counting lets
+    Ollama silently cut the head of the prompt, system prompt included.
+    """
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return max(1, (len(text) - non_ascii) // 4 + non_ascii)
+
+def context_window(budget: int, max_tokens: Optional[int] = None) -> int:
+    """num_ctx that fits a ``budget``-token history plus the reply."""
+    return budget + max(max_tokens or 0, SESSION_RESPONSE_TOKENS)
+
+class ChatSession:
+    def __init__(self, session_id: str, model: str):
+        self.session_id = session_id
+        self.model = model
+        self.messages: List[Dict[str, str]] = []
+        self.last_used = time.time()
+        self.trim_count = 0
+        self.lock = asyncio.Lock()
+
+    def token_count(self) -> int:
+        return sum(estimate_tokens(m["content"]) for m in self.messages)
+
+    def append(self, messages: List[Dict[str, str]]):
+        """Append new turns, replacing the system prompt only if it actually changed."""
+        for message in messages:
+            if message["role"] == "system" and self.messages and self.messages[0]["role"] == "system":
+                if self.messages[0]["content"] != message["content"]:
+                    self.messages[0] = message
+                continue
+            if message["role"] == "system":
+                self.messages.insert(0, message)
+                continue
+            self.messages.append(message)
+        self.last_used = time.time()
+
+    def trim(self, budget: int = SESSION_TOKEN_BUDGET):
+        """Trim the oldest turns once the history exceeds the token budget.
+
+        Trimming goes down to ``SESSION_TRIM_RATIO`` of the budget rather than
+        just below it, so the message prefix sent to Ollama stays identical for
+        many turns in a row and its KV cache can be reused between calls.
+        """
+        if self.token_count() <= budget:
+            return
+
+        target = int(budget * SESSION_TRIM_RATIO)
+        system = [m for m in self.messages if m["role"] == "system"]
+        turns = [m for m in self.messages if m["role"] != "system"]
+        total = sum(estimate_tokens(m["content"]) for m in system + turns)
+
+        # Always keep the latest message so the model has something to answer
+        while len(turns) > 1 and total > target:
+            total -= estimate_tokens(turns.pop(0)["content"])
+        # Don't start the history with a dangling assistant reply
+        while len(turns) > 1 and turns[0]["role"] == "assistant":
+            turns.pop(0)
+
+        self.messages = system + turns
+        self.trim_count += 1
+
+class SessionStore:
+    def __init__(self, ttl: int = SESSION_TTL, max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, ChatSession] = {}
+
+    def _evict(self):
+        now = time.time()
+        expired = [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl]
+        for sid in expired:
+            del self._sessions[sid]
+        # Drop least recently used sessions if we are still over the limit
+        while len(self._sessions) > self.max_sessions:
+            oldest = min(self._sessions.values(), key=lambda s: s.last_used)
+            del self._sessions[oldest.session_id]
+
+    def get_or_create(self, session_id: str, model: str) -> ChatSession:
+        self._evict()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = ChatSession(session_id, model)
+            self._sessions[session_id] = session
+        # A new model can't reuse the old KV cache, but the history carries over
+        session.model = model
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        self._evict()
+        return self._sessions.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+# Create a global session store instance
+session_store = SessionStore()
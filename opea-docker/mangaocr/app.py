@@ -1,10 +1,18 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
 import os
 from PIL import Image
 import io
+import math
+import time
+import zipfile
+import asyncio
+import threading
+
+from inference_executor import InferenceExecutor
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -20,12 +28,26 @@ app.add_middleware(
 
 # Global variables
 _manga_ocr = None
+_manga_ocr_lock = threading.Lock()  # OCR workers may race to load the model on first use
 manga_ocr_available = False
 
+# Upload limits; images larger than MAX_DIMENSION are downscaled rather than rejected
+MAX_IMAGE_BYTES = int(os.getenv("OCR_MAX_IMAGE_MB", 10)) * 1024 * 1024
+MAX_REQUEST_BYTES = int(os.getenv("OCR_MAX_REQUEST_MB", 100)) * 1024 * 1024
+MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", 4096))
+MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", 64_000_000))  # Decompression-bomb guard
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# OCR inference runs here so the event loop (and /health) stays responsive
+ocr_executor = InferenceExecutor("ocr", max_workers=2, max_queue=32, timeout=60)
+
 # Try to import MangaOCR
 print("Initializing MangaOCR module")
 try:
     from manga_ocr import MangaOcr
+    from batch_ocr import OCR_BATCH_SIZE, OCR_BATCH_MAX_IMAGES, ocr_images, preprocess_pool, unpack_zip
+    from regions import detect_text_regions, reading_order
+    from ocr_cache import ocr_cache, image_key, normalize_image
     manga_ocr_available = True
 except ImportError:
     print("MangaOCR not available")
@@ -33,6 +55,12 @@ except ImportError:
 
 # Helper functions
 def get_manga_ocr():
+    if _manga_ocr is not None:
+        return _manga_ocr
+    with _manga_ocr_lock:
+        return _load_manga_ocr()
+
+def _load_manga_ocr():
     global _manga_ocr
     if _manga_ocr is None:
         try:
@@ -65,21 +93,119 @@ def get_manga_ocr():
     print(f"MangaOCR object: {_manga_ocr}")
     return _manga_ocr
 
+def require_manga_ocr():
+    """Return the model from inside an OCR worker, loading it on first use."""
+    ocr = get_manga_ocr()
+    if ocr is None:
+        raise HTTPException(status_code=503, detail="MangaOCR service failed to initialize")
+    return ocr
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Reject oversized uploads from the declared length before the body is read
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and content_length and content_length.isdigit():
+        limit = MAX_REQUEST_BYTES if request.url.path == "/ocr/batch" else MAX_IMAGE_BYTES + UPLOAD_CHUNK_BYTES
+        if int(content_length) > limit:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Request too large. Maximum size is {limit // (1024 * 1024)}MB."}
+            )
+    return await call_next(request)
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    """Read an upload in chunks, rejecting it as soon as it exceeds ``max_bytes``."""
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File {file.filename} too large. Maximum size is {max_bytes // (1024 * 1024)}MB."
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
 def validate_image(image: Image.Image) -> None:
-    """Validate image format and size."""
+    """Validate image format and dimensions from the header, without decoding pixels."""
     # Check image format
     if image.format not in ['PNG', 'JPEG', 'JPG']:
         raise HTTPException(status_code=400, detail="Unsupported image format. Please use PNG or JPEG.")
-    
-    # Check image size
-    max_size = 10 * 1024 * 1024  # 10MB
-    if len(image.tobytes()) > max_size:
-        raise HTTPException(status_code=400, detail="Image size too large. Maximum size is 10MB.")
-    
+
     # Check image dimensions
-    max_dimension = 4096
-    if image.width > max_dimension or image.height > max_dimension:
-        raise HTTPException(status_code=400, detail=f"Image dimensions too large. Maximum dimension is {max_dimension}px.")
+    if image.width * image.height > MAX_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Image dimensions too large. Maximum is {MAX_PIXELS} pixels.")
+
+def load_image(contents: bytes) -> Image.Image:
+    """
+    Validate and decode uploaded image bytes, downscaling anything larger than
+    MAX_DIMENSION. The original size is kept in ``image.info["original_size"]``.
+    """
+    if len(contents) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image size too large. Maximum size is {MAX_IMAGE_BYTES // (1024 * 1024)}MB.")
+
+    try:
+        # Only the header is read here
+        image = Image.open(io.BytesIO(contents))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+
+    validate_image(image)
+    original_size = image.size
+
+    try:
+        if max(image.size) > MAX_DIMENSION:
+            # JPEG can decode directly at a reduced scale; other formats ignore this
+            image.draft(image.mode, (MAX_DIMENSION, MAX_DIMENSION))
+        image.load()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+
+    if max(image.size) > MAX_DIMENSION:
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION))
+    image.info["original_size"] = original_size
+    return image
+
+def run_single(contents: bytes) -> Tuple[str, bool]:
+    """Decode, normalize, look up and OCR one image; blocking, so it runs on the OCR executor."""
+    ocr = require_manga_ocr()
+    image = normalize_image(load_image(contents))
+    key = None
+    if ocr_cache is not None:
+        key = image_key(image)
+        text = ocr_cache.get(key)
+        if text is not None:
+            return text, True
+    text = ocr(image)
+    if ocr_cache is not None:
+        ocr_cache.put(key, text)
+    return text, False
+
+def run_batch(items: List[Tuple[str, bytes]]) -> List[dict]:
+    """Decode, validate and OCR a batch of images; blocking, so it runs on the OCR executor."""
+    ocr = require_manga_ocr()
+    def try_load(item):
+        # Keep only the small normalized copy, so at most one full-size decode per
+        # preprocessing thread is alive instead of every image in the batch
+        try:
+            return normalize_image(load_image(item[1])), None
+        except HTTPException as e:
+            return None, e.detail
+
+    loaded = list(preprocess_pool.map(try_load, items))
+    results = ocr_images(ocr, [image for image, _ in loaded], cache=ocr_cache)
+
+    batch = []
+    for index, ((filename, _), (_, error), result) in enumerate(zip(items, loaded, results)):
+        entry = {"index": index, "filename": filename, **result}
+        if error:
+            entry["error"] = error
+        batch.append(entry)
+    return batch
 
 @app.post("/ocr")
 async def ocr_image(file: UploadFile = File(...), language: Optional[str] = Form("ja")):
@@ -87,33 +213,21 @@ async def ocr_image(file: UploadFile = File(...), language: Optional[str] = Form
         if not manga_ocr_available:
             raise HTTPException(status_code=503, detail="MangaOCR service is not available")
             
-        ocr = get_manga_ocr()
-        if ocr is None:
-            raise HTTPException(status_code=503, detail="MangaOCR service failed to initialize")
-
         # Validate file type
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
 
-        # Read the uploaded file
-        contents = await file.read()
-        
-        try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(contents))
-            image.load()
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+        # Read the uploaded file, stopping early if it is too large
+        contents = await read_upload(file, MAX_IMAGE_BYTES)
 
-        # Validate image
-        validate_image(image)
-        
-        # Process with MangaOCR using the PIL Image
+        # Decode, validate and process with MangaOCR off the event loop
         try:
-            text = ocr(image)
+            text, cached = await ocr_executor.run(run_single, contents)
             if not text:
                 raise HTTPException(status_code=422, detail="No text could be extracted from the image")
-            return {"text": text, "language": language}
+            return {"text": text, "language": language, "cached": cached}
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing image with OCR: {str(e)}")
                 
@@ -122,18 +236,155 @@ async def ocr_image(file: UploadFile = File(...), language: Optional[str] = Form
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+def run_page(contents: bytes) -> Tuple[List[dict], float]:
+    """Detect text blocks on a page and OCR them in reading order; runs on the OCR executor."""
+    ocr = require_manga_ocr()
+    image = load_image(contents)
+    # Report boxes in the coordinates of the uploaded image, even if it was downscaled
+    original_width, _ = image.info["original_size"]
+    scale = original_width / image.width
+    start = time.perf_counter()
+    boxes = reading_order(detect_text_regions(image))
+    detect_ms = (time.perf_counter() - start) * 1000
+    if not boxes:
+        # Nothing that looks like a text block; read the page as a single block
+        boxes = [(0, 0, image.width, image.height)]
+
+    crops = [image.crop((x, y, x + w, y + h)) for x, y, w, h in boxes]
+    results = ocr_images(ocr, crops)
+
+    regions = []
+    for (x, y, w, h), result in zip(boxes, results):
+        if not result["text"]:
+            continue
+        regions.append({
+            "index": len(regions),
+            "bbox": {"x": round(x * scale), "y": round(y * scale), "width": round(w * scale), "height": round(h * scale)},
+            **result
+        })
+    return regions, round(detect_ms, 2)
+
+@app.post("/ocr/page")
+async def ocr_page(file: UploadFile = File(...), language: Optional[str] = Form("ja")):
+    """OCR every text block on a full page, returned right-to-left, top-to-bottom with bounding boxes."""
+    try:
+        if not manga_ocr_available:
+            raise HTTPException(status_code=503, detail="MangaOCR service is not available")
+
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+
+        contents = await read_upload(file, MAX_IMAGE_BYTES)
+
+        start = time.perf_counter()
+        try:
+            timeout = ocr_executor.timeout * 4 if ocr_executor.timeout else None
+            regions, detect_ms = await ocr_executor.run(run_page, contents, timeout=timeout)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing page with OCR: {str(e)}")
+
+        return {
+            "text": "\n".join(region["text"] for region in regions),
+            "regions": regions,
+            "language": language,
+            "count": len(regions),
+            "detect_ms": detect_ms,
+            "total_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+@app.post("/ocr/batch")
+async def ocr_batch(files: List[UploadFile] = File(...), language: Optional[str] = Form("ja")):
+    """OCR many images (or zip archives of images) in one request using batched generation."""
+    try:
+        if not manga_ocr_available:
+            raise HTTPException(status_code=503, detail="MangaOCR service is not available")
+
+        items = []
+        for file in files:
+            if (file.filename or "").lower().endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed"):
+                contents = await read_upload(file, MAX_REQUEST_BYTES)
+                try:
+                    # Archives share the request's image count and byte budgets
+                    items.extend(unpack_zip(
+                        contents,
+                        MAX_IMAGE_BYTES,
+                        max_images=OCR_BATCH_MAX_IMAGES - len(items),
+                        max_total_bytes=MAX_REQUEST_BYTES - sum(len(data) for _, data in items)
+                    ))
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"Invalid zip archive: {file.filename}")
+                except ValueError as e:
+                    raise HTTPException(status_code=413, detail=str(e))
+            else:
+                items.append((file.filename, await read_upload(file, MAX_IMAGE_BYTES)))
+            if len(items) > OCR_BATCH_MAX_IMAGES:
+                break
+
+        if not items:
+            raise HTTPException(status_code=400, detail="No images found in the request")
+        if len(items) > OCR_BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"Too many images. Maximum is {OCR_BATCH_MAX_IMAGES} per request.")
+
+        # Give larger batches proportionally more time before the executor gives up
+        timeout = ocr_executor.timeout * math.ceil(len(items) / OCR_BATCH_SIZE) if ocr_executor.timeout else None
+        start = time.perf_counter()
+        try:
+            results = await ocr_executor.run(run_batch, items, timeout=timeout)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing images with OCR: {str(e)}")
+
+        return {
+            "results": results,
+            "language": language,
+            "count": len(results),
+            "total_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+async def warm_up():
+    # Load the model on the executor in the background so /health answers immediately
+    try:
+        await ocr_executor.run(get_manga_ocr, timeout=600)
+    except Exception as e:
+        print(f"Warning: MangaOCR warm-up failed: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    if manga_ocr_available:
+        asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    ocr_executor.shutdown()
+    if manga_ocr_available:
+        preprocess_pool.shutdown(wait=False, cancel_futures=True)
+
 @app.get("/health")
 async def health_check():
     try:
-        # Check MangaOCR status
+        # Check MangaOCR status without loading the model on the event loop
         manga_ocr_status = "available" if manga_ocr_available else "not available"
         if manga_ocr_available:
-            ocr = get_manga_ocr()
-            manga_ocr_status = "initialized" if ocr is not None else "not initialized"
+            manga_ocr_status = "initialized" if _manga_ocr is not None else "not initialized"
             
         return {
             "status": "healthy", 
-            "manga_ocr_status": manga_ocr_status
+            "manga_ocr_status": manga_ocr_status,
+            "executor": ocr_executor.stats(),
+            "ocr_cache": ocr_cache.stats() if manga_ocr_available and ocr_cache else {"enabled": False}
         }
     except Exception as e:
         return {
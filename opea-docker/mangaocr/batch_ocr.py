@@ -0,0 +1,135 @@
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from ocr_cache import OcrCache, image_key, normalize_image
+
+# MangaOcr.__call__ runs this on the decoded text; mirror it for batched output
+try:
+    from manga_ocr.ocr import post_process
+except ImportError:
+    def post_process(text: str) -> str:
+        return "".join(text.split())
+
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", 8))
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", 64))
+OCR_ZIP_MAX_ENTRIES = int(os.getenv("OCR_ZIP_MAX_ENTRIES", 1024))  # Including folders and non-images
+OCR_MAX_LENGTH = 300  # Same generation limit MangaOcr uses
+
+# Image decoding and resizing release the GIL, so a few threads keep the model fed
+preprocess_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("OCR_PREPROCESS_WORKERS", 4)),
+    thread_name_prefix="ocr-preprocess"
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+def unpack_zip(data: bytes, max_member_bytes: int, max_images: int = OCR_BATCH_MAX_IMAGES,
+               max_total_bytes: Optional[int] = None) -> List[Tuple[str, bytes]]:
+    """
+    Return (filename, bytes) for every image in a zip archive, in name order.
+
+    Entry count, member sizes and their total are checked from the directory
+    before anything is inflated; since the directory can lie, members are
+    then read with the same limits enforced on the actual inflated bytes.
+    Raises ValueError when any limit is exceeded.
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        entries = archive.infolist()
+        if len(entries) > OCR_ZIP_MAX_ENTRIES:
+            raise ValueError(f"Archive has too many entries. Maximum is {OCR_ZIP_MAX_ENTRIES}.")
+        members = sorted(
+            (info for info in entries
+             if info.filename.lower().endswith(IMAGE_EXTENSIONS) and not info.filename.startswith("__MACOSX/")),
+            key=lambda info: info.filename
+        )
+        if len(members) > max_images:
+            raise ValueError(f"Too many images. Maximum is {OCR_BATCH_MAX_IMAGES} per request.")
+        for info in members:
+            if info.file_size > max_member_bytes:
+                raise ValueError(f"{info.filename} is too large. Maximum size is {max_member_bytes // (1024 * 1024)}MB.")
+        budget = max_total_bytes if max_total_bytes is not None else max_member_bytes * len(members)
+        if sum(info.file_size for info in members) > budget:
+            raise ValueError(f"Archive contents too large. Maximum is {budget // (1024 * 1024)}MB in total.")
+
+        images = []
+        for info in members:
+            limit = min(max_member_bytes, budget)
+            with archive.open(info) as member:
+                contents = member.read(limit + 1)
+            if len(contents) > limit:
+                raise ValueError(f"{info.filename} inflates beyond the allowed size.")
+            budget -= len(contents)
+            images.append((info.filename, contents))
+        return images
+
+def get_processor(ocr):
+    # manga-ocr renamed feature_extractor to processor in later releases
+    return getattr(ocr, "processor", None) or ocr.feature_extractor
+
+def preprocess(ocr, image: Image.Image) -> torch.Tensor:
+    """Turn a PIL image into the pixel tensor MangaOcr would feed the encoder."""
+    image = image.convert("L").convert("RGB")
+    return get_processor(ocr)(image, return_tensors="pt").pixel_values.squeeze(0)
+
+def generate_texts(ocr, pixel_values: List[torch.Tensor]) -> List[str]:
+    """Run one batched generate call; inputs are already resized to the encoder size."""
+    batch = torch.stack(pixel_values).to(ocr.model.device)
+    with torch.inference_mode():
+        sequences = ocr.model.generate(batch, max_length=OCR_MAX_LENGTH)
+    return [post_process(ocr.tokenizer.decode(seq, skip_special_tokens=True)) for seq in sequences.cpu()]
+
+def ocr_images(ocr, images: List[Optional[Image.Image]], batch_size: int = OCR_BATCH_SIZE,
+               cache: Optional[OcrCache] = None) -> List[Dict[str, Any]]:
+    """
+    OCR a list of PIL images in padded batches.
+
+    ``None`` entries (images that failed to load) are skipped and come back
+    with an empty text so results stay aligned with the input. Images are
+    normalized first and, with a ``cache``, looked up by their pixels so
+    only misses reach the model. Each result carries the image's
+    preprocessing time and its share of the batch's generation time.
+    """
+    def timed_preprocess(image):
+        start = time.perf_counter()
+        image = normalize_image(image)
+        key = text = pixels = None
+        if cache is not None:
+            key = image_key(image)
+            text = cache.get(key)
+        if text is None:
+            pixels = preprocess(ocr, image)
+        return pixels, key, text, (time.perf_counter() - start) * 1000
+
+    results: List[Dict[str, Any]] = [
+        {"text": "", "cached": False, "preprocess_ms": 0.0, "inference_ms": 0.0} for _ in images
+    ]
+    valid = [i for i, image in enumerate(images) if image is not None]
+    prepared = list(preprocess_pool.map(timed_preprocess, [images[i] for i in valid]))
+
+    pending = []
+    for i, (pixels, key, text, preprocess_ms) in zip(valid, prepared):
+        results[i]["preprocess_ms"] = round(preprocess_ms, 2)
+        if text is None:
+            pending.append((i, pixels, key))
+        else:
+            results[i]["text"] = text
+            results[i]["cached"] = True
+
+    for offset in range(0, len(pending), batch_size):
+        chunk = pending[offset:offset + batch_size]
+        start = time.perf_counter()
+        texts = generate_texts(ocr, [pixels for _, pixels, _ in chunk])
+        per_image_ms = (time.perf_counter() - start) * 1000 / len(chunk)
+        for (i, _, key), text in zip(chunk, texts):
+            results[i]["text"] = text
+            results[i]["inference_ms"] = round(per_image_ms, 2)
+            if cache is not None:
+                cache.put(key, text)
+    return results
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+MODEL_INPUT_SIZE = 224  # MangaOcr's ViT encoder resizes every image to 224x224
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", 2048))
+OCR_CACHE_HASH_SIZE = int(os.getenv("OCR_CACHE_HASH_SIZE", 16))  # 16 -> 256-bit hash
+# Near matching is opt-in: a 16x16 dHash can't tell "123" from "128", so any
+# candidate within this many Hamming bits must also pass a pixel comparison
+OCR_CACHE_MAX_DISTANCE = int(os.getenv("OCR_CACHE_MAX_DISTANCE", 0))
+OCR_CACHE_CONFIRM_SIZE = 64  # Side of the thumbnail used to confirm near matches
+OCR_CACHE_CONFIRM_TOLERANCE = int(os.getenv("OCR_CACHE_CONFIRM_TOLERANCE", 48))  # Max per-pixel difference
+
+def normalize_image(image: Image.Image) -> Image.Image:
+    """
+    Convert to grayscale and shrink until the shorter side reaches the model
+    input size. The encoder resizes to 224x224 anyway, so detail beyond that is
+    never seen by the model; dropping it early makes hashing and preprocessing
+    cheap.
+    """
+    image = image.convert("L")
+    scale = MODEL_INPUT_SIZE / min(image.width, image.height)
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.BILINEAR)
+    return image
+
+def dhash(image: Image.Image, hash_size: int = OCR_CACHE_HASH_SIZE) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a tiny thumbnail."""
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+class ImageKey(NamedTuple):
+    digest: str  # sha256 of the normalized pixels; exact hits only
+    phash: int  # dHash, to find near-match candidates
+    thumbnail: np.ndarray  # Small grayscale copy, to confirm near-match candidates
+
+def image_key(image: Image.Image) -> ImageKey:
+    """Cache key for a normalized image (see :func:`normalize_image`)."""
+    gray = image.convert("L")
+    digest = hashlib.sha256(f"{gray.width}x{gray.height}".encode() + gray.tobytes()).hexdigest()
+    thumbnail = np.asarray(
+        gray.resize((OCR_CACHE_CONFIRM_SIZE, OCR_CACHE_CONFIRM_SIZE), Image.BILINEAR), dtype=np.int16
+    )
+    return ImageKey(digest, dhash(gray), thumbnail)
+
+def same_pixels(a: np.ndarray, b: np.ndarray, tolerance: int = OCR_CACHE_CONFIRM_TOLERANCE) -> bool:
+    """True when no thumbnail pixel differs by more than ``tolerance``; a changed glyph always does."""
+    return int(np.abs(a - b).max()) <= tolerance
+
+class OcrCache:
+    """LRU cache of OCR text keyed by the normalized image's pixels.
+
+    Lookups hit on an exact pixel digest. With ``max_distance`` above zero
+    they then consider entries whose dHash is within that many Hamming bits,
+    but only return one whose thumbnail also matches pixel for pixel (within
+    a tolerance), so a canvas re-encoded between reruns can still hit while
+    an image with different text never does.
+    """
+
+    def __init__(self, max_entries: int = OCR_CACHE_MAX_ENTRIES, max_distance: int = OCR_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[str, Tuple[ImageKey, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get(self, key: ImageKey) -> Optional[str]:
+        with self._lock:
+            if key.digest in self._entries:
+                self._entries.move_to_end(key.digest)
+                self.hits += 1
+                return self._entries[key.digest][1]
+            if self.max_distance > 0:
+                candidates = sorted(
+                    (((stored.phash ^ key.phash).bit_count(), digest) for digest, (stored, _) in self._entries.items()),
+                    key=lambda candidate: candidate[0]
+                )
+                for distance, digest in candidates:
+                    if distance > self.max_distance:
+                        break
+                    stored, text = self._entries[digest]
+                    if same_pixels(stored.thumbnail, key.thumbnail):
+                        self._entries.move_to_end(digest)
+                        self.near_hits += 1
+                        return text
+            self.misses += 1
+            return None
+
+    def put(self, key: ImageKey, text: str):
+        with self._lock:
+            self._entries[key.digest] = (key, text)
+            self._entries.move_to_end(key.digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0
+            }
+
+ocr_cache = OcrCache() if OCR_CACHE_ENABLED else None
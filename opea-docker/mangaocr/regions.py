@@ -0,0 +1,78 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+Box = Tuple[int, int, int, int]  # x, y, width, height
+
+DETECT_MAX_SIDE = 1600  # Pages are analysed at most this large; boxes are scaled back
+
+def detect_text_regions(image: Image.Image, padding: int = 8) -> List[Box]:
+    """
+    Find blocks of text on a manga page with connected components.
+
+    Dark strokes are binarized with an adaptive threshold; components the
+    size of a glyph are kept (panel borders, screentone and large artwork are
+    too big or too small) and dilated so the glyphs of one bubble merge into
+    a single block. Blocks that are too small or too sparse are dropped.
+    """
+    gray = np.asarray(image.convert("L"))
+    scale = min(1.0, DETECT_MAX_SIDE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    height, width = gray.shape
+
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+
+    # Keep only glyph-sized components
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    min_glyph = max(3, int(height * 0.004))
+    max_glyph = int(height * 0.08)
+    glyph_h = stats[:, cv2.CC_STAT_HEIGHT]
+    glyph_w = stats[:, cv2.CC_STAT_WIDTH]
+    keep = (np.maximum(glyph_h, glyph_w) >= min_glyph) & (np.maximum(glyph_h, glyph_w) <= max_glyph)
+    keep[0] = False  # background
+    glyphs = np.where(keep[labels], 255, 0).astype(np.uint8)
+
+    # Merge glyphs into columns (Japanese is mostly vertical), then columns into blocks
+    glyph_size = int(np.median(np.maximum(glyph_h, glyph_w)[keep])) if keep.any() else min_glyph
+    column = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, glyph_size // 2), glyph_size))
+    block = cv2.getStructuringElement(cv2.MORPH_RECT, (glyph_size, max(1, glyph_size // 2)))
+    merged = cv2.dilate(cv2.dilate(glyphs, column), block)
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+    boxes = []
+    for x, y, w, h, area in stats[1:]:
+        if w < glyph_size or h < glyph_size:
+            continue
+        if w * h > 0.5 * width * height:
+            continue
+        # Text blocks are fairly solid after dilation; line art isn't
+        if area < 0.3 * w * h:
+            continue
+        x0 = max(0, int((x - padding) / scale))
+        y0 = max(0, int((y - padding) / scale))
+        x1 = min(image.width, int((x + w + padding) / scale))
+        y1 = min(image.height, int((y + h + padding) / scale))
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
+
+def reading_order(boxes: List[Box]) -> List[Box]:
+    """
+    Sort boxes in manga reading order: rows top to bottom, right to left within a row.
+
+    A box joins the current row when it starts above the middle of the row's
+    lowest box so far; otherwise it starts a new row.
+    """
+    rows: List[List[Box]] = []
+    row_middle = None
+    for box in sorted(boxes, key=lambda b: b[1]):
+        x, y, w, h = box
+        if rows and y < row_middle:
+            rows[-1].append(box)
+            row_middle = max(row_middle, y + h / 2)
+        else:
+            rows.append([box])
+            row_middle = y + h / 2
+    return [box for row in rows for box in sorted(row, key=lambda b: -(b[0] + b[2]))]
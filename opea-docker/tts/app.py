@@ -1,15 +1,28 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
+import re
+import struct
 import base64
-import tempfile
+import io
+import queue
+import asyncio
+import threading
 from contextlib import asynccontextmanager
 import torch
 import logging
 import traceback
+import numpy as np
+import soundfile as sf
+from TTS import __version__ as TTS_VERSION
 from TTS.api import TTS
 
+from voice_cache import VoiceLatentCache
+from audio_cache import AudioCache
+from inference_executor import InferenceExecutor
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,6 +31,19 @@ TTS_DATA_PATH = os.getenv("TTS_DATA_PATH", "/app/data/tts_data")
 VOICES_PATH = os.path.join(TTS_DATA_PATH, "voices")
 MALE_VOICE_PATH = os.path.join(VOICES_PATH, "male_voice.wav")
 FEMALE_VOICE_PATH = os.path.join(VOICES_PATH, "female_voice.wav")
+LATENTS_PATH = os.path.join(VOICES_PATH, "latents")
+AUDIO_CACHE_PATH = os.getenv("AUDIO_CACHE_PATH", os.path.join(TTS_DATA_PATH, "audio_cache"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", 1024)) * 1024 * 1024
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+TTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+MODEL_VERSION = f"{TTS_MODEL_NAME}@{TTS_VERSION}"
+TTS_BATCH_MAX_LINES = int(os.getenv("TTS_BATCH_MAX_LINES", 100))
+TTS_BATCH_MAX_PAUSE_MS = 10000
+# How often a stream waiting on the worker checks whether its job is still alive
+STREAM_POLL_SECONDS = 1.0
+
+# One synthesis at a time by default; XTTS already uses every core on CPU
+tts_executor = InferenceExecutor("tts", max_workers=1, max_queue=16, timeout=300)
 
 os.makedirs(TTS_DATA_PATH, exist_ok=True)
 logger.info(f"TTS data path: {TTS_DATA_PATH}")
@@ -29,9 +55,26 @@ class TTSRequest(BaseModel):
     language: Optional[str] = "en"
     speed: Optional[float] = 1.0
 
+class TTSStreamRequest(TTSRequest):
+    format: Optional[str] = "wav"  # 'wav' (streaming header + PCM) or 'pcm' (raw s16le)
+    native_streaming: Optional[bool] = False  # Use XTTS inference_stream within each sentence
+
+class BatchLine(BaseModel):
+    text: str
+    voice_id: Optional[str] = None
+    pause_ms: Optional[int] = Field(0, ge=0, le=TTS_BATCH_MAX_PAUSE_MS)  # Silence inserted after this line when combining
+
+class TTSBatchRequest(BaseModel):
+    lines: List[BatchLine]
+    language: Optional[str] = "ja"
+    speed: Optional[float] = 1.0
+    combine: Optional[bool] = True  # One combined file instead of individual clips
+    format: Optional[str] = "wav"  # 'wav', 'ogg' or 'mp3'
+
 class TTSResponse(BaseModel):
     audio: str  # base64 encoded audio
     format: str = "wav"
+    cached: bool = False  # True if served from the audio cache
 
 _tts_model = None
 
@@ -43,7 +86,7 @@ def get_tts_model():
             device = "cuda" if torch.cuda.is_available() else "cpu"
             logger.info(f"Using device: {device}")
             
-            _tts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+            _tts_model = TTS(TTS_MODEL_NAME).to(device)
             logger.info(f"Coqui XTTS v2 model loaded successfully on {device}")
         except Exception as e:
             logger.error(f"Failed to load Coqui XTTS v2: {e}")
@@ -51,7 +94,7 @@ def get_tts_model():
                 logger.info("Attempting to fall back to CPU...")
                 device = "cpu"
                 try:
-                    _tts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+                    _tts_model = TTS(TTS_MODEL_NAME).to(device)
                     logger.info("Coqui XTTS v2 model loaded successfully on CPU")
                 except Exception as e:
                     logger.error(f"Failed to load Coqui XTTS v2 on CPU: {e}")
@@ -71,55 +114,416 @@ def resolve_voice_path(voice_id: Optional[str]) -> Optional[str]:
     logger.warning(f"Voice reference file not found: {voice_id}")
     return None
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Starting up TTS service...")
+_voice_cache = None
+# Caches are created lazily from both executor and request threads
+_cache_init_lock = threading.Lock()
+
+def get_voice_cache() -> VoiceLatentCache:
+    global _voice_cache
+    with _cache_init_lock:
+        if _voice_cache is None:
+            _voice_cache = VoiceLatentCache(LATENTS_PATH)
+    return _voice_cache
+
+def synthesize(text: str, voice_id: Optional[str], language: str, speed: float = 1.0):
+    """Synthesize text and return (waveform, sample_rate).
+
+    When a reference voice is available the cached XTTS conditioning latents
+    are fed straight to the model instead of passing ``speaker_wav``.
+    """
+    tts = get_tts_model()
+    speaker_wav = resolve_voice_path(voice_id)
+    logger.info(f"Using speaker_wav: {speaker_wav}")
+
+    if speaker_wav is None:
+        wav = tts.tts(text=text, language=language)
+        return np.asarray(wav, dtype=np.float32), tts.synthesizer.output_sample_rate
+
+    xtts = tts.synthesizer.tts_model
+    gpt_cond_latent, speaker_embedding = get_voice_cache().get(xtts, speaker_wav)
+    out = xtts.inference(
+        text,
+        language,
+        gpt_cond_latent,
+        speaker_embedding,
+        speed=speed or 1.0
+    )
+    wav = out["wav"]
+    if torch.is_tensor(wav):
+        wav = wav.cpu().numpy()
+    return np.asarray(wav, dtype=np.float32), xtts.config.audio.output_sample_rate
+
+_audio_cache = None
+
+def get_audio_cache() -> Optional[AudioCache]:
+    global _audio_cache
+    with _cache_init_lock:
+        if _audio_cache is None and AUDIO_CACHE_ENABLED:
+            _audio_cache = AudioCache(AUDIO_CACHE_PATH, AUDIO_CACHE_MAX_BYTES)
+    return _audio_cache
+
+def lookup_audio(cache_key: str) -> Optional[bytes]:
+    """Cached audio for a key, or None; a file read, so callers run it via asyncio.to_thread."""
+    cache = get_audio_cache()
+    return cache.get(cache_key) if cache is not None else None
+
+def voice_cache_key(voice_id: Optional[str]) -> str:
+    """Identify a voice by its reference WAV contents, so replacing the file invalidates cached audio."""
+    speaker_wav = resolve_voice_path(voice_id)
+    if speaker_wav is None:
+        return "default"
+    return get_voice_cache().wav_hash(speaker_wav)
+
+def audio_cache_key(text: str, voice_id: Optional[str], language: str, speed: float, fmt: str = "wav") -> str:
+    return AudioCache.make_key(text, voice_cache_key(voice_id), language, speed, MODEL_VERSION, fmt)
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？!?])|\n+")
+
+def split_sentences(text: str) -> List[str]:
+    """Split text at Japanese (and ASCII) sentence-ending punctuation and newlines."""
+    return [part.strip() for part in SENTENCE_BOUNDARY.split(text) if part and part.strip()]
+
+def to_pcm16(wav: np.ndarray) -> bytes:
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def wav_stream_header(sample_rate: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """WAV header for a stream of unknown length (sizes set to the maximum, as players expect)."""
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+def _pump_inference_stream(sentence: str, speaker_wav: str, language: str, speed: float, chunks: queue.Queue,
+                           stop: threading.Event):
+    """Run XTTS streaming inference on a worker, handing chunks to the response thread.
+
+    Stops between chunks once ``stop`` is set, i.e. the client has gone away.
+    """
+    try:
+        xtts = get_tts_model().synthesizer.tts_model
+        gpt_cond_latent, speaker_embedding = get_voice_cache().get(xtts, speaker_wav)
+        for chunk in xtts.inference_stream(
+            sentence,
+            language,
+            gpt_cond_latent,
+            speaker_embedding,
+            speed=speed or 1.0,
+            enable_text_splitting=False
+        ):
+            if stop.is_set():
+                break
+            chunks.put(chunk.cpu().numpy())
+    finally:
+        chunks.put(None)
+
+def synthesize_stream(text: str, voice_id: Optional[str], language: str, speed: float = 1.0,
+                      native: bool = False) -> Iterator[np.ndarray]:
+    """Yield waveform chunks in order, one or more per sentence.
+
+    Synthesis itself runs on the TTS executor so streams share its concurrency limit.
+    """
+    speaker_wav = resolve_voice_path(voice_id)
+    for sentence in split_sentences(text):
+        if native and speaker_wav is not None:
+            chunks = queue.Queue()
+            stop = threading.Event()
+            job = tts_executor.submit(_pump_inference_stream, sentence, speaker_wav, language, speed, chunks, stop)
+            try:
+                waited = 0.0
+                while True:
+                    try:
+                        chunk = chunks.get(timeout=STREAM_POLL_SECONDS)
+                    except queue.Empty:
+                        if job.done():
+                            # Cancelled or failed before the worker could send its end marker
+                            break
+                        waited += STREAM_POLL_SECONDS
+                        if tts_executor.timeout and waited >= tts_executor.timeout:
+                            raise HTTPException(
+                                status_code=504, detail=f"tts inference timed out after {tts_executor.timeout}s"
+                            )
+                        continue
+                    if chunk is None:
+                        break
+                    waited = 0.0
+                    yield chunk
+                # Surface any exception raised on the worker
+                job.result()
+            finally:
+                # Runs on errors and when the client disconnects (the generator is closed)
+                stop.set()
+                job.cancel()
+        else:
+            wav, _ = tts_executor.call(synthesize, sentence, voice_id, language, speed)
+            yield wav
+
+# Binary output formats, encoded in memory by libsndfile (no ffmpeg needed)
+AUDIO_FORMATS = {
+    "wav": {"media_type": "audio/wav", "format": "WAV", "subtype": "PCM_16"},
+    "ogg": {"media_type": "audio/ogg", "format": "OGG", "subtype": "OPUS"},
+    "mp3": {"media_type": "audio/mpeg", "format": "MP3", "subtype": "MPEG_LAYER_III"},
+}
+ACCEPT_TYPES = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/*": "wav",
+}
+
+def negotiate_audio_format(accept: str) -> Optional[str]:
+    """Return the binary format the Accept header prefers, or None for the JSON response."""
+    candidates = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    pass
+        candidates.append((-quality, position, media_type.lower()))
+    for _, _, media_type in sorted(candidates):
+        if media_type in ACCEPT_TYPES:
+            return ACCEPT_TYPES[media_type]
+        if media_type in ("application/json", "*/*"):
+            return None
+    return None
+
+def encode_audio(wav: np.ndarray, sample_rate: int, fmt: str = "wav") -> bytes:
+    """Encode a waveform into an in-memory audio file."""
+    spec = AUDIO_FORMATS[fmt]
+    buffer = io.BytesIO()
+    sf.write(buffer, wav, sample_rate, format=spec["format"], subtype=spec["subtype"])
+    return buffer.getvalue()
+
+def warm_voice_cache():
+    """Precompute latents for the bundled male/female voices."""
+    tts = get_tts_model()
+    for path in (MALE_VOICE_PATH, FEMALE_VOICE_PATH):
+        if os.path.exists(path):
+            get_voice_cache().get(tts.synthesizer.tts_model, path)
+
+def load_and_warm():
+    get_tts_model()
+    logger.info("TTS model initialized during startup")
+    warm_voice_cache()
+    logger.info("Voice latent cache warmed")
+
+async def warm_up():
+    # Load on the executor in the background so /health answers while the model loads
     try:
-        get_tts_model()
-        logger.info("TTS model initialized during startup")
+        await tts_executor.run(load_and_warm, timeout=3600)
     except Exception as e:
         logger.error(f"Failed to initialize TTS model during startup: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Starting up TTS service...")
+    warm_up_task = asyncio.create_task(warm_up())
     yield
     logger.info("Shutting down TTS service...")
+    warm_up_task.cancel()
+    tts_executor.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
+def render_speech(request: TTSRequest, fmt: str, cache_key: str) -> bytes:
+    """Synthesize and cache audio for a cache miss; runs on the TTS executor."""
+    wav, sample_rate = synthesize(request.text, request.voice_id, request.language, request.speed)
+    audio_data = encode_audio(wav, sample_rate, fmt)
+    cache = get_audio_cache()
+    if cache is not None:
+        cache.put(cache_key, audio_data)
+    return audio_data
+
 @app.post("/tts")
-async def text_to_speech(request: TTSRequest):
+async def text_to_speech(request: TTSRequest, http_request: Request):
     try:
-        tts = get_tts_model()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            temp_filename = temp_file.name
-
-        speaker_wav = resolve_voice_path(request.voice_id)
-        logger.info(f"Using speaker_wav: {speaker_wav}")
-
-        # Synthesize speech
-        tts.tts_to_file(
-            text=request.text,
-            speaker_wav=speaker_wav,
-            language=request.language,
-            file_path=temp_filename
+        # Binary responses when the client asks for audio, legacy base64 JSON otherwise
+        fmt = negotiate_audio_format(http_request.headers.get("accept", ""))
+        # Cache hits are a file read and never wait behind synthesis on the executor
+        cache_key = await asyncio.to_thread(
+            audio_cache_key, request.text, request.voice_id, request.language, request.speed, fmt or "wav"
         )
+        audio_data = await asyncio.to_thread(lookup_audio, cache_key)
+        cached = audio_data is not None
+        if cached:
+            logger.info(f"Audio cache hit: {cache_key}")
+        else:
+            audio_data = await tts_executor.run(render_speech, request, fmt or "wav", cache_key)
 
-        with open(temp_filename, "rb") as audio_file:
-            audio_data = audio_file.read()
+        if fmt is not None:
+            return Response(
+                content=audio_data,
+                media_type=AUDIO_FORMATS[fmt]["media_type"],
+                headers={"X-Cache": "hit" if cached else "miss"}
+            )
         audio_base64 = base64.b64encode(audio_data).decode("utf-8")
-        os.unlink(temp_filename)
-        return TTSResponse(audio=audio_base64, format="wav")
+        return TTSResponse(audio=audio_base64, format="wav", cached=cached)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in text_to_speech: {e}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
 
+@app.post("/tts/stream")
+def text_to_speech_stream(request: TTSStreamRequest):
+    if request.format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail="format must be 'wav' or 'pcm'")
+    if not split_sentences(request.text):
+        raise HTTPException(status_code=400, detail="No text to synthesize")
+    if _tts_model is None:
+        # Don't load the model on this thread; the startup warm-up does that on the executor
+        raise HTTPException(status_code=503, detail="TTS model is still loading")
+    sample_rate = _tts_model.synthesizer.output_sample_rate
+
+    def audio_chunks():
+        # A sync generator: Starlette iterates it in a worker thread, off the event loop
+        if request.format == "wav":
+            yield wav_stream_header(sample_rate)
+        try:
+            for wav in synthesize_stream(
+                request.text, request.voice_id, request.language, request.speed, request.native_streaming
+            ):
+                yield to_pcm16(wav)
+        except Exception as e:
+            # Headers are already sent, so all we can do is stop the stream
+            logger.error(f"Error in text_to_speech_stream: {e}\n{traceback.format_exc()}")
+
+    media_type = "audio/wav" if request.format == "wav" else f"audio/L16;rate={sample_rate};channels=1"
+    return StreamingResponse(
+        audio_chunks(),
+        media_type=media_type,
+        headers={"X-Sample-Rate": str(sample_rate), "X-Channels": "1"}
+    )
+
+@app.post("/tts/batch")
+async def text_to_speech_batch(request: TTSBatchRequest, http_request: Request):
+    """Synthesize a whole dialogue in one call with the model and voice latents loaded once."""
+    if not request.lines:
+        raise HTTPException(status_code=400, detail="lines must not be empty")
+    if len(request.lines) > TTS_BATCH_MAX_LINES:
+        raise HTTPException(status_code=413, detail=f"Too many lines. Maximum is {TTS_BATCH_MAX_LINES} per request.")
+    if request.format not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(AUDIO_FORMATS)}")
+    binary = negotiate_audio_format(http_request.headers.get("accept", "")) is not None
+    try:
+        # Only lines missing from the audio cache go to the executor
+        found = await asyncio.to_thread(lookup_batch, request)
+        missing = [(index, cache_key) for index, (cache_key, clip) in enumerate(found) if clip is None]
+        synthesized = {}
+        if missing:
+            # Each line is a full synthesis, so give the batch proportionally more time
+            timeout = tts_executor.timeout * len(missing) if tts_executor.timeout else None
+            synthesized = await tts_executor.run(synthesize_lines, request, missing, timeout=timeout)
+        clips = []
+        for index, (line, (_, clip)) in enumerate(zip(request.lines, found)):
+            wav, sample_rate = clip if clip is not None else synthesized[index]
+            clips.append({
+                "index": index,
+                "wav": wav,
+                "sample_rate": sample_rate,
+                "pause_ms": max(0, line.pause_ms or 0),
+                "cached": clip is not None
+            })
+        return await asyncio.to_thread(assemble_batch, request, clips, binary)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in text_to_speech_batch: {e}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
+
+def lookup_batch(request: TTSBatchRequest) -> List[Tuple[str, Optional[Tuple[np.ndarray, int]]]]:
+    """(cache key, cached (waveform, sample_rate) or None) per line; runs off the executor."""
+    found = []
+    for line in request.lines:
+        cache_key = audio_cache_key(line.text, line.voice_id, request.language, request.speed)
+        cached_audio = lookup_audio(cache_key)
+        clip = sf.read(io.BytesIO(cached_audio), dtype="float32") if cached_audio is not None else None
+        found.append((cache_key, clip))
+    return found
+
+def synthesize_lines(request: TTSBatchRequest, missing: List[Tuple[int, str]]) -> Dict[int, Tuple[np.ndarray, int]]:
+    """Synthesize and cache the given (index, cache key) lines; runs on the TTS executor."""
+    cache = get_audio_cache()
+    synthesized = {}
+    for index, cache_key in missing:
+        line = request.lines[index]
+        wav, line_rate = synthesize(line.text, line.voice_id, request.language, request.speed)
+        if cache is not None:
+            cache.put(cache_key, encode_audio(wav, line_rate))
+        synthesized[index] = (wav, line_rate)
+    return synthesized
+
+def assemble_batch(request: TTSBatchRequest, clips: List[dict], binary: bool):
+    """Encode individual clips or one combined file with pauses; runs off the executor."""
+    sample_rate = clips[0]["sample_rate"]
+
+    if not request.combine:
+        return {
+            "format": request.format,
+            "sample_rate": sample_rate,
+            "clips": [
+                {
+                    "index": clip["index"],
+                    "audio": base64.b64encode(encode_audio(clip["wav"], sample_rate, request.format)).decode("utf-8"),
+                    "duration": len(clip["wav"]) / sample_rate,
+                    "cached": clip["cached"]
+                }
+                for clip in clips
+            ]
+        }
+
+    # Concatenate in-process with generated silences, keeping per-line offsets
+    parts = []
+    segments = []
+    offset = 0
+    for clip in clips:
+        segments.append({
+            "index": clip["index"],
+            "start": offset / sample_rate,
+            "duration": len(clip["wav"]) / sample_rate,
+            "cached": clip["cached"]
+        })
+        parts.append(clip["wav"])
+        offset += len(clip["wav"])
+        if clip["pause_ms"]:
+            silence = np.zeros(int(sample_rate * clip["pause_ms"] / 1000), dtype=np.float32)
+            parts.append(silence)
+            offset += len(silence)
+    combined = encode_audio(np.concatenate(parts), sample_rate, request.format)
+
+    if binary:
+        return Response(content=combined, media_type=AUDIO_FORMATS[request.format]["media_type"])
+    return {
+        "format": request.format,
+        "sample_rate": sample_rate,
+        "audio": base64.b64encode(combined).decode("utf-8"),
+        "duration": offset / sample_rate,
+        "segments": segments
+    }
+
 @app.get("/health")
 async def health_check():
     model_files = os.listdir(TTS_DATA_PATH) if os.path.exists(TTS_DATA_PATH) else []
     return {
         "status": "healthy",
+        "model_loaded": _tts_model is not None,
+        "executor": tts_executor.stats(),
         "model_files": model_files,
         "tts_home": os.environ.get("TTS_HOME", "not set"),
         "directory_exists": os.path.exists(TTS_DATA_PATH),
-        "directory_permissions": oct(os.stat(TTS_DATA_PATH).st_mode)[-3:] if os.path.exists(TTS_DATA_PATH) else "N/A"
+        "directory_permissions": oct(os.stat(TTS_DATA_PATH).st_mode)[-3:] if os.path.exists(TTS_DATA_PATH) else "N/A",
+        "voice_latent_cache": get_voice_cache().stats(),
+        "audio_cache": get_audio_cache().stats() if get_audio_cache() else "disabled"
     }
 
 @app.get("/voices")
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different requests share a cache entry."""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+class AudioCache:
+    """Content-addressed on-disk cache for synthesized audio.
+
+    Entries are keyed by a hash of (normalized text, voice, language, speed,
+    model version) and stored as one file per entry. An in-memory LRU index
+    tracks sizes so the directory stays under ``max_bytes``; file mtimes are
+    refreshed on every hit so the LRU order survives restarts.
+    """
+
+    def __init__(self, cache_path: str, max_bytes: int):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_path):
+            path = os.path.join(self.cache_path, name)
+            if os.path.isfile(path) and not name.endswith(".tmp"):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total_bytes += size
+        logger.info(f"Audio cache: {len(self._index)} entries, {self._total_bytes} bytes in {self.cache_path}")
+
+    @staticmethod
+    def make_key(text: str, voice: str, language: str, speed: float, model_version: str, fmt: str = "wav") -> str:
+        payload = json.dumps(
+            [normalize_text(text), voice, language, round(float(speed or 1.0), 3), model_version],
+            ensure_ascii=False
+        )
+        return f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()}.{fmt}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = os.path.join(self.cache_path, key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                # File vanished underneath us; drop the stale index entry
+                self._total_bytes -= self._index.pop(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            if len(data) > self.max_bytes:
+                return
+            path = os.path.join(self.cache_path, key)
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Failed to write audio cache entry {key}: {e}")
+                return
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(os.path.join(self.cache_path, key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
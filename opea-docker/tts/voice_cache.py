@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+class VoiceLatentCache:
+    """Caches XTTS speaker conditioning latents per reference WAV.
+
+    Latents are keyed by the SHA-256 of the WAV contents, so replacing a voice
+    file invalidates its entry automatically. Entries live in memory and are
+    persisted as ``<hash>.pt`` files under ``latents_path``.
+    """
+
+    def __init__(self, latents_path: str):
+        self.latents_path = latents_path
+        self._latents: Dict[str, Tuple[torch.Tensor, torch.Tensor]] = {}
+        self._hashes: Dict[Tuple[str, float, int], str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.latents_path, exist_ok=True)
+
+    def wav_hash(self, wav_path: str) -> str:
+        # Re-hash only when the file changes on disk
+        stat = os.stat(wav_path)
+        stat_key = (wav_path, stat.st_mtime, stat.st_size)
+        if stat_key not in self._hashes:
+            with open(wav_path, "rb") as f:
+                self._hashes[stat_key] = hashlib.sha256(f.read()).hexdigest()
+        return self._hashes[stat_key]
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.latents_path, f"{key}.pt")
+
+    def get(self, model, wav_path: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Return (gpt_cond_latent, speaker_embedding) for a reference WAV."""
+        key = self.wav_hash(wav_path)
+        with self._lock:
+            if key in self._latents:
+                self.hits += 1
+                return self._latents[key]
+
+            disk_path = self._disk_path(key)
+            if os.path.exists(disk_path):
+                try:
+                    data = torch.load(disk_path, map_location=model.device)
+                    latents = (data["gpt_cond_latent"], data["speaker_embedding"])
+                    self._latents[key] = latents
+                    self.hits += 1
+                    logger.info(f"Loaded cached voice latents for {wav_path} from {disk_path}")
+                    return latents
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable latent cache file {disk_path}: {e}")
+
+            self.misses += 1
+            logger.info(f"Computing conditioning latents for {wav_path}")
+            gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(audio_path=[wav_path])
+            latents = (gpt_cond_latent, speaker_embedding)
+            self._latents[key] = latents
+            try:
+                torch.save(
+                    {"gpt_cond_latent": gpt_cond_latent.cpu(), "speaker_embedding": speaker_embedding.cpu()},
+                    disk_path
+                )
+            except Exception as e:
+                logger.warning(f"Failed to persist voice latents to {disk_path}: {e}")
+            return latents
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached_voices": len(self._latents), "hits": self.hits, "misses": self.misses}
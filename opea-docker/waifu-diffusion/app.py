@@ -1,13 +1,22 @@
 from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from diffusers import StableDiffusionPipeline
 import torch
 import os
 import io
-from typing import Optional
+import secrets
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
 import base64
 from PIL import Image
 from io import BytesIO
+import asyncio
+
+from inference_executor import InferenceExecutor
+from jobs import JobStore
+from schedulers import PRESETS, StepTimer, build_schedulers, load_lcm_lora, resolve_settings
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -16,6 +25,18 @@ app = FastAPI()
 MODEL_ID = os.getenv("MODEL_ID", "waifu-diffusion/wd-1-5-beta2")
 MODEL_PATH = os.getenv("MODEL_PATH", "/app/data/waifu")
 USE_LOCAL = os.getenv("USE_LOCAL", "True").lower() in ("true", "1", "t")
+JOBS_PATH = os.getenv("JOBS_PATH", "/app/data/waifu-diffusion/jobs")
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 64))
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_HOURS", 24)) * 3600
+JOB_CLEANUP_INTERVAL = 600  # seconds between sweeps of expired jobs
+MAX_BATCH_SIZE = int(os.getenv("DIFFUSION_MAX_BATCH", 4))
+DIFFUSION_PRESET = os.getenv("DIFFUSION_PRESET", "standard")  # draft, standard or high
+LCM_LORA_ID = os.getenv("LCM_LORA_ID", "")  # e.g. latent-consistency/lcm-lora-sdv1-5; enables the 'lcm' scheduler
+
+# CPU tuning
+DIFFUSION_CPU_THREADS = int(os.getenv("DIFFUSION_CPU_THREADS", 0))  # 0 lets torch decide
+DIFFUSION_BF16 = os.getenv("DIFFUSION_BF16", "False").lower() in ("true", "1", "t")  # Fast on CPUs with AVX512-BF16/AMX
+DIFFUSION_ATTENTION_SLICING = os.getenv("DIFFUSION_ATTENTION_SLICING", "True").lower() in ("true", "1", "t")
 
 # Check if CUDA is available
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -24,20 +45,38 @@ print(f"Using device: {device}")
 # Global variable to store the pipeline
 pipe = None
 
+# Selectable schedulers, built once the pipeline is loaded
+schedulers: Dict[str, Any] = {}
+lcm_loaded = False
+# The LCM adapter is toggled on the shared UNet, so requests must not overlap while it is loaded
+lora_lock = threading.Lock()
+
+# Diffusion runs here so the event loop (and /health) stays responsive
+diffusion_executor = InferenceExecutor("diffusion", max_workers=1, max_queue=8, timeout=900)
+
+# Asynchronous jobs: persisted in SQLite and fed to the executor one at a time
+job_store = None
+job_queue = None
+
+def model_dtype():
+    if device == "cuda":
+        return torch.float16
+    return torch.bfloat16 if DIFFUSION_BF16 else torch.float32
+
 def load_model():
     try:
         if USE_LOCAL and os.path.exists(MODEL_PATH):
             print(f"Loading model from local path: {MODEL_PATH}")
             pipe = StableDiffusionPipeline.from_pretrained(
                 MODEL_PATH,
-                torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+                torch_dtype=model_dtype(),
                 safety_checker=None  # Disable safety checker for better performance
             ).to(device)
         else:
             print(f"Downloading model from Hugging Face: {MODEL_ID}")
             pipe = StableDiffusionPipeline.from_pretrained(
                 MODEL_ID,
-                torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+                torch_dtype=model_dtype(),
                 safety_checker=None  # Disable safety checker for better performance
             ).to(device)
             
@@ -56,15 +95,27 @@ def load_model():
 class ImageRequest(BaseModel):
     prompt: str
     negative_prompt: str = ""
-    num_inference_steps: int = 50
-    guidance_scale: float = 7.5
+    preset: Optional[str] = None  # draft, standard or high; DIFFUSION_PRESET when omitted
+    scheduler: Optional[str] = None  # default, dpmpp, euler_a or lcm; overrides the preset's
+    num_inference_steps: Optional[int] = None  # Overrides the preset's
+    guidance_scale: Optional[float] = None  # Overrides the preset's
     width: Optional[int] = 512
     height: Optional[int] = 512
     return_format: Optional[str] = "base64"  # 'base64' or 'binary'
 
-@app.on_event("startup")
-async def startup_event():
-    global pipe
+class BatchImageRequest(BaseModel):
+    prompts: List[str]
+    negative_prompt: str = ""  # Shared by every prompt in the batch
+    preset: Optional[str] = None
+    scheduler: Optional[str] = None
+    num_inference_steps: Optional[int] = None
+    guidance_scale: Optional[float] = None
+    width: Optional[int] = 512
+    height: Optional[int] = 512
+    seeds: Optional[List[int]] = None  # One per prompt; random when omitted
+
+def load_pipeline():
+    global pipe, device
     try:
         pipe = load_model()
     except Exception as e:
@@ -77,38 +128,284 @@ async def startup_event():
             except Exception as e:
                 print(f"Failed to load model on CPU: {str(e)}")
                 raise e
+    tune_pipeline()
+
+def tune_pipeline():
+    """Apply CPU tuning and set up the selectable schedulers."""
+    global schedulers, lcm_loaded
+    if device == "cpu":
+        if DIFFUSION_CPU_THREADS > 0:
+            torch.set_num_threads(DIFFUSION_CPU_THREADS)
+        if DIFFUSION_ATTENTION_SLICING:
+            # Bounds peak memory of batched attention at a small speed cost
+            pipe.enable_attention_slicing()
+        # oneDNN convolutions are faster on NHWC tensors
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    lcm_loaded = load_lcm_lora(pipe, LCM_LORA_ID)
+    schedulers = build_schedulers(pipe, lcm=lcm_loaded)
+    print(f"Schedulers: {', '.join(schedulers)} (threads={torch.get_num_threads()}, dtype={model_dtype()})")
+
+def request_settings(request) -> Dict[str, Any]:
+    """Scheduler, steps and guidance for a request; raises ValueError for unknown names."""
+    return resolve_settings(
+        request.preset, request.scheduler, request.num_inference_steps, request.guidance_scale,
+        list(schedulers), DIFFUSION_PRESET
+    )
+
+@contextmanager
+def scheduler_pipeline(name: str):
+    """
+    Yield a pipeline for one request that shares the loaded weights but has
+    its own scheduler, so concurrent workers (DIFFUSION_WORKERS > 1) never
+    run with each other's scheduler or step state.
+    """
+    template = schedulers[name]
+    pipeline = StableDiffusionPipeline(
+        **{**pipe.components, "scheduler": template.__class__.from_config(template.config)},
+        requires_safety_checker=False
+    )
+    if not lcm_loaded:
+        yield pipeline
+        return
+    with lora_lock:
+        if name == "lcm":
+            pipe.enable_lora()
+        else:
+            pipe.disable_lora()
+        yield pipeline
+
+async def warm_up():
+    # Load the pipeline on the executor in the background so /health answers immediately
+    try:
+        await diffusion_executor.run(load_pipeline, timeout=3600)
+    except Exception as e:
+        print(f"Failed to load model: {str(e)}")
+
+def encode_png(image: Image.Image) -> bytes:
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def run_job(job_id: str, request: "ImageRequest"):
+    """Run a queued job and store its image; blocking, so it runs on the diffusion executor."""
+    if pipe is None:
+        raise Exception("Model not loaded")
+    job_store.mark_running(job_id)
+    image, timings = run_pipeline(request, request_settings(request))
+    if not job_store.mark_succeeded(job_id, encode_png(image), result={"timings": timings}):
+        print(f"Job {job_id} finished after it was already marked finished; result dropped")
+
+async def job_worker():
+    # Jobs take one executor slot at a time, so they interleave with /generate instead of starving it
+    while True:
+        job_id, request = await job_queue.get()
+        try:
+            while True:
+                try:
+                    job = diffusion_executor.submit(run_job, job_id, request)
+                    break
+                except HTTPException as e:
+                    if e.status_code != 503:
+                        raise
+                    # Executor queue full of synchronous requests; wait for room
+                    await asyncio.sleep(5)
+            # No timeout here: the executor timeout would also count time spent queued
+            # behind /generate calls, and a running pipeline can't be stopped anyway
+            await asyncio.wrap_future(job.future)
+        except HTTPException as e:
+            job_store.mark_failed(job_id, e.detail)
+        except Exception as e:
+            job_store.mark_failed(job_id, str(e))
+        finally:
+            job_queue.task_done()
+
+async def job_cleanup():
+    while True:
+        try:
+            removed = job_store.cleanup(JOB_TTL_SECONDS)
+            if removed:
+                print(f"Removed {removed} expired jobs")
+        except Exception as e:
+            print(f"Job cleanup failed: {str(e)}")
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+@app.on_event("startup")
+async def startup_event():
+    global job_store, job_queue
+    job_store = JobStore(JOBS_PATH)
+    interrupted = job_store.fail_unfinished("Interrupted by service restart")
+    if interrupted:
+        print(f"Marked {interrupted} unfinished jobs as failed")
+    job_queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    asyncio.create_task(warm_up())
+    asyncio.create_task(job_worker())
+    asyncio.create_task(job_cleanup())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    diffusion_executor.shutdown()
+
+def run_pipeline(request: ImageRequest, settings: Dict[str, Any]):
+    """Run one diffusion pass and return (image, timings); blocking, so it runs on the diffusion executor."""
+    with scheduler_pipeline(settings["scheduler"]) as pipeline:
+        timer = StepTimer()
+        image = pipeline(
+            prompt=request.prompt,
+            negative_prompt=request.negative_prompt,
+            num_inference_steps=settings["num_inference_steps"],
+            guidance_scale=settings["guidance_scale"],
+            width=request.width,
+            height=request.height,
+            callback_on_step_end=timer
+        ).images[0]
+    return image, {**settings, **timer.timings()}
+
+def run_batch_pipeline(request: BatchImageRequest, settings: Dict[str, Any], seeds: List[int]):
+    """Run every prompt through one batched diffusion pass; blocking, so it runs on the diffusion executor."""
+    # CPU generators give the same image for a seed whichever device the pipeline runs on
+    generators = [torch.Generator("cpu").manual_seed(seed) for seed in seeds]
+    with scheduler_pipeline(settings["scheduler"]) as pipeline:
+        timer = StepTimer()
+        images = pipeline(
+            prompt=request.prompts,
+            negative_prompt=[request.negative_prompt] * len(request.prompts),
+            num_inference_steps=settings["num_inference_steps"],
+            guidance_scale=settings["guidance_scale"],
+            width=request.width,
+            height=request.height,
+            generator=generators,
+            callback_on_step_end=timer
+        ).images
+    return images, {**settings, **timer.timings()}
 
 @app.post("/generate")
 async def generate_image(request: ImageRequest):
     if pipe is None:
         raise HTTPException(status_code=500, detail="Model not loaded")
+    try:
+        settings = request_settings(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
         # Generate the image
-        image = pipe(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            num_inference_steps=request.num_inference_steps,
-            guidance_scale=request.guidance_scale,
-            width=request.width,
-            height=request.height
-        ).images[0]
+        image, timings = await diffusion_executor.run(run_pipeline, request, settings)
         
         # Prepare the response
         if request.return_format == "binary":
             # Return the image as binary data
             img_byte_arr = io.BytesIO()
             image.save(img_byte_arr, format="PNG")
-            return Response(content=img_byte_arr.getvalue(), media_type="image/png")
+            return Response(
+                content=img_byte_arr.getvalue(),
+                media_type="image/png",
+                headers={
+                    "X-Scheduler": timings["scheduler"],
+                    "X-Inference-Steps": str(timings["steps"]),
+                    "X-Seconds-Per-Step": str(timings["seconds_per_step"])
+                }
+            )
         else:
             # Return the image as base64
             buffered = io.BytesIO()
             image.save(buffered, format="PNG")
             img_str = base64.b64encode(buffered.getvalue()).decode()
-            return {"status": "success", "image": img_str}
+            return {"status": "success", "image": img_str, "timings": timings}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate/batch")
+async def generate_batch(request: BatchImageRequest):
+    """Generate one image per prompt in a single pipeline call; images come back base64-encoded in prompt order."""
+    if pipe is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="No prompts provided")
+    if len(request.prompts) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Too many prompts. Maximum batch size is {MAX_BATCH_SIZE}.")
+    if request.seeds is not None and len(request.seeds) != len(request.prompts):
+        raise HTTPException(status_code=400, detail="seeds must have one entry per prompt")
+    try:
+        settings = request_settings(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    seeds = request.seeds if request.seeds is not None else [secrets.randbelow(2 ** 32) for _ in request.prompts]
+    try:
+        # A batch costs roughly one pass per image in the worst case, so scale the timeout with it
+        timeout = diffusion_executor.timeout * len(request.prompts) if diffusion_executor.timeout else None
+        images, timings = await diffusion_executor.run(run_batch_pipeline, request, settings, seeds, timeout=timeout)
+        return {
+            "status": "success",
+            "images": [
+                {"prompt": prompt, "seed": seed, "image": base64.b64encode(encode_png(image)).decode()}
+                for prompt, seed, image in zip(request.prompts, seeds, images)
+            ],
+            "timings": timings
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/jobs", status_code=202)
+async def create_job(request: ImageRequest):
+    """Queue an image for generation and return immediately; poll GET /jobs/{id} for the result."""
+    if job_queue.full():
+        raise HTTPException(status_code=503, detail=f"Job queue is full ({JOB_QUEUE_SIZE} jobs); retry later")
+    if schedulers:
+        # Reject bad presets now rather than failing the job later; before the model loads they're checked when it runs
+        try:
+            request_settings(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    job_id = job_store.create(request.dict())
+    job_queue.put_nowait((job_id, request))
+    return {
+        "id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "image_url": f"/jobs/{job_id}/image"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    response = {
+        "id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+    if job["status"] == "succeeded":
+        response["image_url"] = f"/jobs/{job_id}/image"
+        if job["result"]:
+            response["result"] = job["result"]
+    elif job["status"] == "failed":
+        response["error"] = job["error"]
+    return response
+
+@app.get("/jobs/{job_id}/image")
+async def get_job_image(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+    path = job_store.image_path(job_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Job image has expired")
+    return FileResponse(path, media_type="image/png")
+
 @app.get("/health")
 async def health_check():
     global pipe
@@ -125,7 +422,20 @@ async def health_check():
             "model": MODEL_ID,
             "model_status": model_status,
             "device": device,
-            "cuda_status": cuda_status
+            "cuda_status": cuda_status,
+            "executor": diffusion_executor.stats(),
+            "max_batch_size": MAX_BATCH_SIZE,
+            "dtype": str(model_dtype()),
+            "threads": torch.get_num_threads(),
+            "default_preset": DIFFUSION_PRESET,
+            "presets": list(PRESETS),
+            "schedulers": list(schedulers),
+            "lcm_lora": LCM_LORA_ID if lcm_loaded else None,
+            "jobs": {
+                "queued": job_queue.qsize() if job_queue else 0,
+                "max_queue": JOB_QUEUE_SIZE,
+                "by_status": job_store.stats() if job_store else {}
+            }
         }
     except Exception as e:
         return {
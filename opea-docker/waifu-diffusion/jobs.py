@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+class JobStore:
+    """Persistent record of diffusion jobs plus their finished images.
+
+    Jobs live in a SQLite table so their status survives restarts; images are
+    written as ``<id>.png`` under ``images/``. Finished jobs and their images
+    are removed by :meth:`cleanup` once they are older than the TTL.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.images_path = os.path.join(path, "images")
+        os.makedirs(self.images_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, "jobs.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, request TEXT NOT NULL, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, result TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at)")
+        self._conn.commit()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def create(self, request: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, status, request, created_at) VALUES (?, 'queued', ?, ?)",
+            (job_id, json.dumps(request), time.time())
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._conn.row_factory = sqlite3.Row
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            self._conn.row_factory = None
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def image_path(self, job_id: str) -> str:
+        return os.path.join(self.images_path, f"{job_id}.png")
+
+    def mark_running(self, job_id: str):
+        self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def mark_succeeded(self, job_id: str, png: bytes, result: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Store the image and mark a running job succeeded. Returns False (and
+        drops the image) if the job already finished, e.g. it was failed
+        while this run was still going.
+        """
+        path = self.image_path(job_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'succeeded', finished_at = ?, result = ? WHERE id = ? AND status = 'running'",
+            (time.time(), json.dumps(result) if result else None, job_id)
+        )
+        if cursor.rowcount:
+            return True
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return False
+
+    def mark_failed(self, job_id: str, error: str):
+        self._execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+            (time.time(), error, job_id)
+        )
+
+    def fail_unfinished(self, error: str) -> int:
+        """Fail jobs a previous process left queued or running."""
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE status IN ('queued', 'running')",
+            (time.time(), error)
+        )
+        return cursor.rowcount
+
+    def cleanup(self, ttl_seconds: float) -> int:
+        """Delete finished jobs older than ``ttl_seconds`` and their images."""
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)
+            )]
+            self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            self._conn.commit()
+        for job_id in expired:
+            try:
+                os.unlink(self.image_path(job_id))
+            except OSError:
+                pass
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
@@ -42,7 +42,8 @@ class SentenceGenerator:
             json={
                 "model": "llama3.2",
                 "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.0
+                "temperature": 0.0,
+                "task_class": "classification"
             }
         )
         if response.status_code == 200: